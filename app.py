@@ -8,19 +8,29 @@ App Template for static publishing.
 """
 
 import app_config
+import deltas
+import documents
+import hashlib
+import json
 import logging
 import oauth
 import os
-import parse_doc
+import render_engine
+import response_cache
 import static
+import time
 
 from copydoc import CopyDoc
 import copytext
-from flask import Flask, make_response, render_template
+from datetime import datetime
+from flask import Flask, Response, abort, make_response, render_template
+from flask import stream_with_context
+from functools import wraps
 from flask_cors import CORS, cross_origin
-from render_utils import flatten_app_config, make_context
+from render_utils import make_context
 from render_utils import smarty_filter, urlencode_filter
 from werkzeug.debug import DebuggedApplication
+from werkzeug.http import is_resource_modified, quote_etag
 
 app = Flask(__name__)
 app.debug = app_config.DEBUG
@@ -29,68 +39,334 @@ CORS(app)
 app.add_template_filter(smarty_filter, name='smarty')
 app.add_template_filter(urlencode_filter, name='urlencode')
 
+engine = render_engine.RenderEngine(app.jinja_env)
+
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
 
+page_cache = response_cache.ResponseCache(app_config.RESPONSE_CACHE_SIZE,
+                                          app_config.RESPONSE_CACHE_BYTES)
+delta_history = deltas.DeltaHistory(app_config.DELTA_HISTORY_SIZE)
+# Time of the last templates walk and its result
+templates_state = (0, None)
+
+
+def walk_templates():
+    """
+    Fingerprint and last modification time of the files under
+    the templates folder
+    """
+    parts = []
+    last_modified = 0
+    for root, dirs, files in os.walk(app.jinja_loader.searchpath[0]):
+        for name in sorted(files):
+            st = os.stat(os.path.join(root, name))
+            parts.append('%s:%s:%s' % (name, st.st_mtime, st.st_size))
+            last_modified = max(last_modified, st.st_mtime)
+    return hashlib.sha1('|'.join(parts)).hexdigest(), last_modified
+
+
+def get_templates_fingerprint():
+    """
+    Fingerprint and last modification time of the templates
+    and the deployment target they are rendered for
+
+    Templates only change with a deploy outside DEBUG so the folder
+    is walked once, in DEBUG at most every TEMPLATES_CHECK_INTERVAL
+    """
+    global templates_state
+    now = time.time()
+    checked_at, walked = templates_state
+    if (walked is None or (app_config.DEBUG and
+            now - checked_at >= app_config.TEMPLATES_CHECK_INTERVAL)):
+        walked = walk_templates()
+        templates_state = (now, walked)
+    fingerprint, last_modified = walked
+    return hashlib.sha1('%s|%s' % (
+        app_config.DEPLOYMENT_TARGET, fingerprint)).hexdigest(), last_modified
+
+
+def make_etag(version, fingerprint, key):
+    """
+    ETag of the page under key, see page_key, for a document version
+    and templates fingerprint
+    """
+    return hashlib.sha1((u'%s:%s:%s' % (
+        version, fingerprint, key)).encode('utf-8')).hexdigest()
+
+
+def encoded_etag(etag, encoding):
+    """
+    ETag of a page sent with encoding, compressed bodies get their own
+    """
+    if encoding == 'identity':
+        return etag
+    return '%s-%s' % (etag, encoding)
+
+
+def get_request_document(key=None):
+    """
+    DocumentCache of the transcript a request is for: the one stored
+    under key in DOCUMENTS_PATH or the main transcript. Unknown keys
+    are answered with a 404
+    """
+    if key is None:
+        return documents.get_document_cache()
+    path = documents.document_path(key)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    return documents.get_document_cache(path)
+
+
+def get_page_cache(cache):
+    """
+    Page cache of the views of a document
+    """
+    if cache.html_path == app_config.TRANSCRIPT_HTML_PATH:
+        return page_cache
+    return cache.attachment('pages', lambda: response_cache.ResponseCache(
+        app_config.RESPONSE_CACHE_SIZE, app_config.RESPONSE_CACHE_BYTES))
+
+
+def get_delta_history(cache):
+    """
+    Published versions of a document to compute deltas from
+    """
+    if cache.html_path == app_config.TRANSCRIPT_HTML_PATH:
+        return delta_history
+    return cache.attachment('deltas', lambda: deltas.DeltaHistory(
+        app_config.DELTA_HISTORY_SIZE))
+
+
+def stream_chunks(chunks):
+    """
+    Send a page as it is rendered, in chunks of about
+    STREAM_CHUNK_SIZE characters, instead of building the whole page
+    """
+    def generate():
+        buf = []
+        size = 0
+        for chunk in chunks:
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= app_config.STREAM_CHUNK_SIZE:
+                yield u''.join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield u''.join(buf)
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+def window_contents(contents, published_only):
+    """
+    Entries selected by the from and limit arguments, counted over
+    the entries the view shows, None if there are no such arguments
+    """
+    start, limit, since = page_args()
+    if start == 0 and limit is None:
+        return None
+    if published_only:
+        contents = [c for c in contents if c.get('published') == 'yes']
+    if limit is None:
+        return contents[start:]
+    return contents[start:start + limit]
+
+
+def render_factcheck_page(context, preview):
+    contents = window_contents(context['contents'], not preview)
+    # Cached pages are kept whole, only stream when they are not cached
+    if app_config.STREAM_FACTCHECK and not app_config.RESPONSE_CACHE:
+        return stream_chunks(engine.generate_factcheck(context, preview,
+                                                       contents))
+    return make_response(engine.factcheck(context, preview, contents))
+
+
+def page_args():
+    """
+    The from, limit and since arguments the views read, normalized the
+    way window_contents applies them
+    """
+    from flask import request
+    start = max(request.args.get('from', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 0:
+        limit = None
+    return start, limit, request.args.get('since')
+
+
+def page_key():
+    """
+    Key of the page in the page cache: the path and the normalized
+    arguments, in a fixed order, so other arguments share the page
+    """
+    from flask import request
+    args = page_args()
+    if args == (0, None, None):
+        return request.path
+    return u'%s?from=%s&limit=%s&since=%s' % ((request.path,) + args)
+
+
+def is_cacheable_page(cache):
+    """
+    Whether the page requested is kept in the page cache: whole pages,
+    windows starting on a multiple of their limit and deltas since a
+    version of the history, not any combination a client asks for
+    """
+    start, limit, since = page_args()
+    if since is not None and since not in get_delta_history(cache).versions:
+        return False
+    if limit is None:
+        return start == 0
+    return limit > 0 and start % limit == 0
+
+
+def cached_view(view, pages, version, fingerprint, *args, **kwargs):
+    """
+    Serve the page of the document version and templates fingerprint
+    from pages, rendering and storing it on a miss, in the best encoding
+    the client accepts. Pages rendered from another version than the
+    one requested are not stored, nor any page when pages is None
+    """
+    from flask import g, request
+    if not app_config.RESPONSE_CACHE or pages is None:
+        return view(*args, **kwargs)
+    key = page_key()
+    page = pages.get((version, fingerprint), key)
+    if page is None:
+        response = view(*args, **kwargs)
+        if (response.status_code != 200 or
+                getattr(g, 'document_version', None) != version):
+            return response
+        if response.is_streamed:
+            return response
+        page = pages.put((version, fingerprint), key, response.data,
+                         response.headers['Content-Type'])
+    encoding, body = page.encode(request.accept_encodings)
+    response = app.response_class(body, content_type=page.content_type)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def conditional(view):
+    """
+    Validate views of the transcript with an ETag built from the
+    document version and the templates, and a Last-Modified date from
+    the transcript file, answering conditional requests with a 304
+    before the document is parsed or the template rendered
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from flask import g, request
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        cache = get_request_document(kwargs.get('key'))
+        try:
+            mtime = os.path.getmtime(cache.html_path)
+            version = cache.peek_version()
+        except (IOError, OSError):
+            return view(*args, **kwargs)
+        fingerprint, templates_mtime = get_templates_fingerprint()
+        key = page_key()
+        pages = None
+        encoding = 'identity'
+        if app_config.RESPONSE_CACHE and is_cacheable_page(cache):
+            pages = get_page_cache(cache)
+            encoding = response_cache.best_encoding(request.accept_encodings)
+        etag = encoded_etag(make_etag(version, fingerprint, key), encoding)
+        last_modified = datetime.utcfromtimestamp(max(mtime,
+                                                      templates_mtime))
+        if not is_resource_modified(request.environ,
+                                    etag=quote_etag(etag),
+                                    last_modified=last_modified):
+            response = app.response_class(status=304)
+        else:
+            response = cached_view(view, pages, version, fingerprint,
+                                   *args, **kwargs)
+            served = getattr(g, 'document_version', version)
+            if served != version:
+                # The cache served the previous version while reparsing
+                last_modified = None
+            etag = encoded_etag(make_etag(served, fingerprint, key),
+                                response.headers.get('Content-Encoding',
+                                                     'identity'))
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        return response
+    return wrapper
+
 
 @app.route('/factcheck.html', methods=['GET', 'OPTIONS'])
-def _factcheck():
+@app.route('/docs/<key>/factcheck.html', methods=['GET', 'OPTIONS'])
+@conditional
+def _factcheck(key=None):
     """
     Liveblog only contains published posts
     """
-    context = get_factcheck_context()
-    return make_response(render_template('factcheck.html', **context))
+    context = get_factcheck_context(key)
+    return render_factcheck_page(context, preview=False)
 
 
 @app.route('/factcheck_preview.html', methods=['GET', 'OPTIONS'])
+@conditional
 def _preview():
     """
     Preview contains published and draft posts
     """
     context = get_factcheck_context()
-    return make_response(render_template('factcheck.html', **context))
+    return render_factcheck_page(context, preview=True)
+
+@app.route('/factcheck.json', methods=['GET', 'OPTIONS'])
+@app.route('/docs/<key>/factcheck.json', methods=['GET', 'OPTIONS'])
+@conditional
+def _factcheck_delta(key=None):
+    """
+    Published entries inserted, updated and removed since
+    the version given in the since argument
+    """
+    from flask import request
+    context = get_factcheck_context(key)
+    history = get_delta_history(get_request_document(key))
+    delta = history.delta(request.args.get('since'),
+                          context['live_version'])
+    return make_response(json.dumps(delta), 200,
+                         {'Content-Type': 'application/json'})
 
 @app.route('/embeds/<slug>.html', methods=['GET', 'OPTIONS'])
-def _embed(slug):
+@app.route('/docs/<key>/embeds/<slug>.html', methods=['GET', 'OPTIONS'])
+@conditional
+def _embed(slug, key=None):
     """
     Specific annotations can be embedded
     """
-    context = get_factcheck_context();
-    context['slug'] = slug
-    contents = context['contents']
-    annotations = [post for post in contents if post['type'] == 'annotation' and post['published'] == 'yes']
-    filtered = [post for post in annotations if post['slug'] == slug]
-    filtered = filtered[0]
-    context['filtered'] = filtered
-
-    index = contents.index(filtered)
-    paragraphs = int(filtered.get('prior', 1))
-    start = index - paragraphs;
-    prior = contents[start:index]
-    context['prior'] = prior
-    return make_response(render_template('embed.html', **context))
+    context = get_factcheck_context(key)
+    page = engine.embed(context, slug)
+    if page is None:
+        abort(404)
+    return make_response(page)
 
 @app.route('/embeds/', methods=['GET', 'OPTIONS'])
-def _embedlist():
+@app.route('/docs/<key>/embeds/', methods=['GET', 'OPTIONS'])
+@conditional
+def _embedlist(key=None):
     """
     List out embeddable annotations
     """
-    context = get_factcheck_context()
-    contents = context['contents']
-    annotations = [post for post in contents if post['type'] == 'annotation' and post['published'] == 'yes']
-    published = [x for x in annotations if x['published'] == 'yes']
-    slugs = [x['slug'] for x in published]
-    context['slugs'] = slugs
-    return make_response(render_template('embedlist.html', **context))
+    context = get_factcheck_context(key)
+    return make_response(engine.embedlist(context))
 
 @app.route('/share.html', methods=['GET', 'OPTIONS'])
+@conditional
 def _share():
     """
     Preview contains published and draft posts
     """
     context = get_factcheck_context()
-    return make_response(render_template('share.html', **context))
+    return make_response(engine.share(context))
 
 
 @app.route('/copydoc.html', methods=['GET', 'OPTIONS'])
@@ -145,32 +421,23 @@ app.register_blueprint(static.static)
 app.register_blueprint(oauth.oauth)
 
 
-def get_factcheck_context():
+def get_factcheck_context(key=None):
     """
-    Get factcheck context
-    for production we will reuse a fake g context
-    in order not to perform the parsing twice
+    Context shared by the pages of the current version of the
+    transcript, built once per version by the render engine
+
+    key selects a transcript of DOCUMENTS_PATH instead of the main one
     """
     from flask import g
-    context = make_context()
-    context['config'] = flatten_app_config()
-    parsed_factcheck_doc = getattr(g, 'parsed_factcheck', None)
-    if parsed_factcheck_doc is None:
-        logger.debug("did not find parsed_factcheck")
-        with open(app_config.TRANSCRIPT_HTML_PATH) as f:
-            html = f.read()
-        context.update(parse_document(html))
-    else:
-        logger.debug("found parsed_factcheck in g")
-        context.update(parsed_factcheck_doc)
-    return context
+    cache = get_request_document(key)
+    g.document_version, parsed_factcheck_doc = cache.get_versioned()
+    history = get_delta_history(cache)
+    return engine.context(parsed_factcheck_doc,
+                          history.add(parsed_factcheck_doc))
 
 
 def parse_document(html):
-    doc = CopyDoc(html)
-    parsed_document = parse_doc.parse(doc)
-
-    return parsed_document
+    return documents.parse_document(html)
 
 
 # Enable Werkzeug debug pages
@@ -137,6 +137,88 @@ AUTHORS_PATH = 'data/authors.xlsx'
 
 TRANSCRIPT_HTML_PATH = 'data/transcript.html'
 LOAD_COPY_INTERVAL = 10
+# Minimum seconds between two downloads triggered by ?refresh
+REFRESH_MIN_INTERVAL = 5
+# Reuse unchanged paragraphs and annotations from the previous parse
+INCREMENTAL_PARSE = True
+# Additional transcripts served under /docs/<key>/ as {key: google doc key}
+DOCUMENTS = {}
+# Folder of the transcripts served under /docs/<key>/, one <key>.html each
+DOCUMENTS_PATH = 'data/docs'
+# Number of parsed transcripts each app process keeps in memory
+DOCUMENT_CACHE_SIZE = 16
+# Share parsed documents between processes through a snapshot file
+# written beside the transcript html
+PARSE_SNAPSHOTS = True
+# Keep the rendered views of the current document version in memory
+RESPONSE_CACHE = True
+# Maximum number of rendered views kept per document version
+RESPONSE_CACHE_SIZE = 500
+# Maximum bytes of rendered views, in every encoding, kept per document
+RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+# Seconds between checks for edited templates when DEBUG is on
+TEMPLATES_CHECK_INTERVAL = 2
+# Send factcheck.html while it is rendered instead of building it first,
+# only when RESPONSE_CACHE is off since cached pages are kept whole
+STREAM_FACTCHECK = False
+# Characters buffered before each streamed chunk is sent
+STREAM_CHUNK_SIZE = 16384
+# Publish the changes to the published transcript as json delta files
+RENDER_DELTAS = True
+# Number of previous versions clients can request deltas from
+DELTA_HISTORY_SIZE = 50
+# Delta history of the renderer, kept across daemon restarts
+DELTA_HISTORY_PATH = 'data/deltas.history'
+# Notify live clients through public_app when a new version is deployed
+LIVE_NOTIFICATIONS = False
+# Published version file watched by public_app
+PUBLISHED_VERSION_PATH = 'data/published_version.json'
+# Seconds between checks of the published version file
+NOTIFICATION_CHECK_INTERVAL = 1
+# Seconds a long poll request waits for a new version
+LONG_POLL_TIMEOUT = 25
+# Seconds before an event stream is closed, below the uwsgi harakiri
+EVENT_STREAM_DURATION = 90
+# Seconds between keepalive comments on an idle event stream
+EVENT_STREAM_HEARTBEAT = 15
+# Seconds browsers wait before reconnecting to a closed event stream
+NOTIFICATION_RETRY = 3
+# Concurrent connections per uwsgi worker when notifications are enabled
+NOTIFICATION_CONNECTIONS = 5000
+# Categorize the transcript while reading it instead of building the tree
+STREAMING_CATEGORIZER = False
+# Process documents with at least this many records on a process pool
+# from the main thread, None parses on a single process. Records are
+# cheap to process since markup is rendered lazily, so pickling them for
+# the workers is usually slower than a serial parse
+PARALLEL_PARSE_THRESHOLD = None
+# Number of parser processes, defaults to the number of cpus
+PARALLEL_PARSE_PROCESSES = None
+# Maximum number of rendered transcript fragments kept in memory
+FRAGMENT_CACHE_SIZE = 20000
+# Set to a path (e.g. 'data/fragment_cache.pickle') to persist the cache
+FRAGMENT_CACHE_PATH = None
+# Threads rendering views and embeds in "fab render", 1 renders serially
+RENDER_WORKERS = 4
+# Digests of the inputs of each rendered embed, only changed embeds
+# are rendered again
+EMBEDS_MANIFEST_PATH = 'data/embeds.manifest.json'
+# Rendered files changed since they were last deployed
+ARTIFACTS_MANIFEST_PATH = 'data/artifacts.manifest.json'
+# Minified javascript and compiled css of each source, set to None
+# to compress them on every render
+COMPRESSION_CACHE_PATH = 'data/compression_cache'
+# Compressed files kept in COMPRESSION_CACHE_PATH, the least recently
+# used ones are removed
+COMPRESSION_CACHE_SIZE = 200
+# Time the phases of every daemon cycle
+INSTRUMENTATION = False
+# Timings of each cycle are appended as json lines, logged if None
+INSTRUMENTATION_LOG_PATH = 'logs/pipeline.jsonl'
+# Number of cycles the p50/p95 of each phase are computed over
+INSTRUMENTATION_WINDOW = 100
+# Log the p50/p95 of each phase every this many cycles
+INSTRUMENTATION_SUMMARY_CYCLES = 10
 # Number of cycles needed to refresh the author excel file
 REFRESH_AUTHOR_CYCLES = 6
 
@@ -224,11 +306,17 @@ def get_secrets():
     return secrets_dict
 
 
+# Incremented on every configure_targets call so that values derived
+# from the configuration know when to rebuild
+configuration_generation = 0
+
+
 def configure_targets(deployment_target):
     """
     Configure deployment targets. Abstracted so this can be
     overriden for rendering before deployment.
     """
+    global configuration_generation
     global S3_BUCKET
     global S3_BASE_URL
     global S3_DEPLOY_URL
@@ -327,6 +415,7 @@ def configure_targets(deployment_target):
             pass
 
     DEPLOYMENT_TARGET = deployment_target
+    configuration_generation += 1
 
 
 """
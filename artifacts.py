@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Rendered files written only when their contents change.
+
+Files are replaced atomically so the app and the deploy never read a
+partial file. Every file that did change or was removed is recorded in
+a manifest kept on disk until it is deployed, so that deploying a
+folder uploads and deletes those files instead of walking and hashing
+the whole tree.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+MANIFEST_FORMAT_VERSION = 2
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_hash(path):
+    """
+    Hash of the contents of path, None if it does not exist
+    """
+    try:
+        with open(path, 'rb') as f:
+            return content_hash(f.read())
+    except IOError:
+        return None
+
+
+def write_file(path, data, manifest=None):
+    """
+    Write data to path unless it already holds the same contents,
+    returning whether the file changed. Unicode is encoded to utf-8
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    path = os.path.normpath(path)
+    if file_hash(path) == content_hash(data):
+        return False
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            pass
+
+    tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(),
+                                 threading.current_thread().ident)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+    if manifest is None:
+        manifest = get_manifest()
+    manifest.add(path)
+    return True
+
+
+def remove_file(path, manifest=None):
+    """
+    Remove a rendered file, recording the removal so that the deploy
+    deletes it too
+    """
+    path = os.path.normpath(path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if manifest is None:
+        manifest = get_manifest()
+    manifest.remove(path)
+
+
+def _under(path, root):
+    return path.startswith(root + os.sep)
+
+
+class ChangeManifest(object):
+    """
+    Paths written or removed since they were last deployed.
+
+    Every write is numbered in sequence. Each deployment of a folder,
+    identified by the folder, the bucket and the destination prefix, is
+    listed in roots with the sequence number it was deployed up to. A
+    deployment is only made from the manifest once it has been deployed
+    in full while the manifest was kept.
+
+    The daemon and the deploy tasks may run in different processes, so
+    the changes made since the manifest was last saved are also kept in
+    a log. Saving replays the log over the file on disk, under a file
+    lock, numbering the changes after the ones other processes saved.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._reset()
+        self._log = []
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def _reset(self):
+        self.sequence = 0
+        # Path to the sequence number of its latest write
+        self.changed = {}
+        # Path to the sequence number of its removal
+        self.removed = {}
+        # (folder, bucket, destination) to the sequence deployed
+        self.roots = {}
+
+    def add(self, path):
+        self._record('add', os.path.normpath(path))
+
+    def remove(self, path):
+        self._record('remove', os.path.normpath(path))
+
+    def _record(self, *change):
+        with self.lock:
+            self._log.append(change)
+            self._apply(change)
+
+    def _apply(self, change):
+        action = change[0]
+        if action == 'add':
+            self.sequence += 1
+            self.changed[change[1]] = self.sequence
+            self.removed.pop(change[1], None)
+        elif action == 'remove':
+            self.sequence += 1
+            self.changed.pop(change[1], None)
+            self.removed[change[1]] = self.sequence
+        elif action == 'deployed':
+            root, sequence = change[1:]
+            self.roots[root] = max(sequence, self.roots.get(root, 0))
+            self._prune()
+
+    def _root(self, src, bucket_name, dst):
+        return (os.path.normpath(src), bucket_name, dst)
+
+    def _paths_under(self, paths, root, since):
+        root = os.path.normpath(root)
+        return sorted(path for path, sequence in paths.iteritems()
+                      if sequence > since and _under(path, root))
+
+    def changed_under(self, root, since=0):
+        """
+        Paths inside the folder root changed after the sequence number
+        since, sorted
+        """
+        with self.lock:
+            return self._paths_under(self.changed, root, since)
+
+    def pending(self, src, bucket_name, dst):
+        """
+        Current sequence number, the paths of src changed and the ones
+        removed since it was deployed to dst on bucket_name. Changed paths
+        are None if it never was, all the removed paths are returned then
+        """
+        with self.lock:
+            deployed = self.roots.get(self._root(src, bucket_name, dst))
+            if deployed is None:
+                return (self.sequence, None,
+                        self._paths_under(self.removed, src, 0))
+            return (self.sequence,
+                    self._paths_under(self.changed, src, deployed),
+                    self._paths_under(self.removed, src, deployed))
+
+    def deployed(self, src, bucket_name, dst, sequence):
+        """
+        Record that src was deployed to dst on bucket_name with every
+        change up to sequence, forgetting the changes every deployment
+        of their folder has seen. The sequence must come from pending
+        after the manifest was saved
+        """
+        self._record('deployed', self._root(src, bucket_name, dst),
+                     sequence)
+
+    def _prune(self):
+        for paths in (self.changed, self.removed):
+            for path, written in paths.items():
+                covering = [deployed for (root, bucket, prefix), deployed
+                            in self.roots.iteritems() if _under(path, root)]
+                if covering and min(covering) >= written:
+                    del paths[path]
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except IOError:
+            return
+        except ValueError, e:
+            logger.warning('Could not load manifest %s: %s' % (self.path, e))
+            return
+        if data.get('version') != MANIFEST_FORMAT_VERSION:
+            return
+        self.sequence = data['sequence']
+        self.changed.update(data['changed'])
+        self.removed.update(data.get('removed', {}))
+        for src, bucket_name, dst, sequence in data['roots']:
+            self.roots[(src, bucket_name, dst)] = sequence
+
+    def _load(self):
+        self._reset()
+        self._read()
+        for change in self._log:
+            self._apply(change)
+
+    def load(self):
+        """
+        Reload the manifest from disk, keeping the changes made since
+        it was last saved
+        """
+        with self.lock:
+            self._load()
+
+    def save(self):
+        """
+        Merge the changes made since the last save with the manifest on
+        disk, saved by this or another process, and persist the result,
+        replacing the previous file atomically
+        """
+        if not self.path:
+            return
+        with open('%s.lock' % self.path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with self.lock:
+                    self._load()
+                    self._log = []
+                    data = {
+                        'version': MANIFEST_FORMAT_VERSION,
+                        'sequence': self.sequence,
+                        'changed': self.changed,
+                        'removed': self.removed,
+                        'roots': sorted(list(root) + [sequence]
+                                        for root, sequence
+                                        in self.roots.iteritems())
+                    }
+                    data = json.dumps(data, sort_keys=True)
+                tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.rename(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    """
+    ChangeManifest of ARTIFACTS_MANIFEST_PATH shared by the process
+    """
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = ChangeManifest(app_config.ARTIFACTS_MANIFEST_PATH)
+        return _manifest
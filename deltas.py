@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Changes to the published transcript between document versions.
+
+Every published entry gets a stable id: annotations are identified
+by their slug and transcript paragraphs by the hash of their markup
+plus the number of identical paragraphs before them. A delta lists
+the entries inserted, updated and removed since a previous version.
+"""
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+HISTORY_FORMAT_VERSION = 2
+
+
+def published_entries(contents):
+    """
+    Ordered map of stable id to markup of the published entries
+    """
+    entries = OrderedDict()
+    occurrences = {}
+    for record in contents:
+        if record.get('published') != 'yes':
+            continue
+        markup = record['markup']
+        if record['type'] == 'annotation' and record.get('slug'):
+            base = 'a-%s' % record['slug']
+        else:
+            digest = hashlib.md5(markup.encode('utf-8')).hexdigest()
+            base = 'p-%s' % digest[:12]
+        count = occurrences.get(base, 0)
+        occurrences[base] = count + 1
+        entries[base if not count else '%s-%s' % (base, count)] = markup
+    return entries
+
+
+def markup_hash(markup):
+    return hashlib.sha1(markup.encode('utf-8')).hexdigest()
+
+
+def entries_version(entries, status):
+    """
+    Version of the published entries, unchanged by edits to drafts
+    """
+    h = hashlib.sha1(str(status))
+    for entry_id, markup in entries.iteritems():
+        h.update(entry_id)
+        h.update(markup.encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def compute_delta(old, new):
+    """
+    Inserted, updated and removed entries turning old into new.
+
+    Inserted entries carry the id of the entry they follow, None for
+    the first one. Entries that changed position are removed and
+    inserted again
+    """
+    old_positions = dict((entry_id, i) for i, entry_id in enumerate(old))
+    inserted = []
+    updated = []
+    kept = set()
+    last_position = -1
+    previous = None
+    for entry_id, markup in new.iteritems():
+        position = old_positions.get(entry_id)
+        if position is not None and position > last_position:
+            last_position = position
+            kept.add(entry_id)
+            if old[entry_id] != markup:
+                updated.append({'id': entry_id, 'markup': markup})
+        else:
+            inserted.append({'id': entry_id, 'after': previous,
+                             'markup': markup})
+        previous = entry_id
+    removed = [entry_id for entry_id in old if entry_id not in kept]
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'removed': removed
+    }
+
+
+class DeltaHistory(object):
+    """
+    Published entries of the latest versions of the document, used to
+    answer delta requests since any of them.
+
+    Each version maps the ids of its entries to the hash of their
+    markup and every markup is stored once in markups, so entries that
+    did not change between versions are not kept again.
+
+    If a path is given the history is saved to and restored from disk
+    so that deltas survive a restart of the process.
+    """
+    def __init__(self, max_versions=50, path=None):
+        self.max_versions = max_versions
+        self.path = path
+        self.versions = OrderedDict()
+        self.statuses = {}
+        self.markups = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        self._document = (None, None)
+        if path:
+            self.load()
+
+    @property
+    def latest(self):
+        with self.lock:
+            if not self.versions:
+                return None
+            return next(reversed(self.versions))
+
+    def add(self, parsed_document):
+        """
+        Record the published entries of a parsed document,
+        returning its version
+        """
+        document, version = self._document
+        if document is parsed_document:
+            return version
+        entries = published_entries(parsed_document['contents'])
+        status = parsed_document['status']
+        version = entries_version(entries, status)
+        with self.lock:
+            if not self.versions or next(reversed(self.versions)) != version:
+                hashes = OrderedDict()
+                for entry_id, markup in entries.iteritems():
+                    digest = markup_hash(markup)
+                    self.markups.setdefault(digest, markup)
+                    hashes[entry_id] = digest
+                self.versions.pop(version, None)
+                self.versions[version] = hashes
+                self.statuses[version] = status
+                while len(self.versions) > self.max_versions:
+                    dropped, _ = self.versions.popitem(last=False)
+                    self.statuses.pop(dropped, None)
+                    self._prune()
+                self.changed = True
+        self._document = (parsed_document, version)
+        return version
+
+    def _prune(self):
+        """
+        Drop the markups no version refers to anymore
+        """
+        used = set()
+        for hashes in self.versions.itervalues():
+            used.update(hashes.itervalues())
+        self.markups = dict((digest, markup)
+                            for digest, markup in self.markups.iteritems()
+                            if digest in used)
+
+    def delta(self, since, version=None):
+        """
+        Delta from since to version, the latest one by default. When since
+        is not known all entries of version are returned as inserted
+        """
+        with self.lock:
+            if version is None:
+                version = next(reversed(self.versions))
+            new = self.versions[version]
+            old = self.versions.get(since)
+            status = self.statuses[version]
+            markups = self.markups
+        delta = compute_delta(old or OrderedDict(), new)
+        for entry in delta['inserted'] + delta['updated']:
+            entry['markup'] = markups[entry['markup']]
+        delta.update({
+            'version': version,
+            'since': since if old is not None else None,
+            'full': old is None,
+            'status': status
+        })
+        return delta
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except IOError:
+            return
+        except Exception, e:
+            logger.warning('Could not load delta history %s: %s' % (
+                           self.path, e))
+            return
+        if data.get('version') != HISTORY_FORMAT_VERSION:
+            return
+        with self.lock:
+            self.markups.update(data['markups'])
+            for version, status, hashes in data['versions']:
+                self.versions[version] = OrderedDict(hashes)
+                self.statuses[version] = status
+
+    def save(self):
+        """
+        Persist the history if it changed since it was loaded or saved,
+        replacing the previous file atomically
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            data = {
+                'version': HISTORY_FORMAT_VERSION,
+                'markups': self.markups,
+                'versions': [(version, self.statuses[version], hashes.items())
+                             for version, hashes in self.versions.items()]
+            }
+            tmp_path = '%s.tmp' % self.path
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path)
+            self.changed = False
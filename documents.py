@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Parsed transcript documents shared between processes.
+
+Parsing writes a snapshot beside the transcript html keyed by the hash
+of its contents, so that the renderer, the embeds and every app worker
+load the parsed document instead of parsing it again.
+"""
+import cPickle as pickle
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import app_config
+import parse_doc
+from collections import OrderedDict
+from copydoc import CopyDoc
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+# Bump when the parsed document format changes
+SNAPSHOT_VERSION = 2
+
+document_key_regex = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+
+def parse_document(html, incremental=None):
+    """
+    Parse the html export of the transcript google doc, reusing the
+    records of the IncrementalCache incremental if INCREMENTAL_PARSE is set
+    """
+    if app_config.STREAMING_CATEGORIZER:
+        doc = parse_doc.StreamingCategorizer(html)
+    else:
+        doc = CopyDoc(html)
+    if not app_config.INCREMENTAL_PARSE:
+        incremental = None
+    return parse_doc.parse(doc, incremental=incremental)
+
+
+def document_path(key):
+    """
+    Path of the html of the transcript stored under key in
+    DOCUMENTS_PATH, None if the key is not valid
+    """
+    if not key or not document_key_regex.match(key):
+        return None
+    return os.path.join(app_config.DOCUMENTS_PATH, '%s.html' % key)
+
+
+def snapshot_path(html_path):
+    return '%s.snapshot' % html_path
+
+
+def authors_stamp():
+    """
+    Version of the authors file used to parse documents, None if
+    there is none
+    """
+    try:
+        st = os.stat(app_config.AUTHORS_PATH)
+    except OSError:
+        return None
+    return '%s:%s' % (st.st_mtime, st.st_size)
+
+
+def document_version(html, authors):
+    """
+    Version of a document parsed from html with the authors file
+    stamped authors
+    """
+    return hashlib.sha1('%s\n%s' % (authors, html)).hexdigest()
+
+
+def document_key(html):
+    """
+    Identifies a parsed document: the html contents plus the version
+    of the authors file that was used to parse it
+    """
+    return {
+        'version': SNAPSHOT_VERSION,
+        'html': hashlib.sha1(html).hexdigest(),
+        'authors': authors_stamp()
+    }
+
+
+def read_snapshot(path, key):
+    """
+    Parsed document stored on path if it was written for key
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header != key:
+                return None
+            return pickle.load(f)
+    except IOError:
+        return None
+    except Exception, e:
+        logger.warning('Could not read snapshot %s: %s' % (path, e))
+        return None
+
+
+def write_snapshot(path, key, parsed_document):
+    """
+    Write the parsed document and its key, replacing the previous
+    snapshot atomically so readers never see a partial file
+    """
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(key, sort_keys=True) + '\n')
+            pickle.dump(parsed_document, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        logger.warning('Could not write snapshot %s: %s' % (path, e))
+
+
+def load_html(html, html_path, incremental=None):
+    """
+    Parsed document for html, read from the snapshot beside html_path
+    when it matches, parsed and snapshotted otherwise
+    """
+    if not app_config.PARSE_SNAPSHOTS:
+        return parse_document(html, incremental)
+    key = document_key(html)
+    path = snapshot_path(html_path)
+    parsed_document = read_snapshot(path, key)
+    if parsed_document is None:
+        logger.info('Parsing %s' % html_path)
+        parsed_document = parse_document(html, incremental)
+        write_snapshot(path, key, parsed_document)
+    else:
+        logger.debug('Loaded snapshot %s' % path)
+    return parsed_document
+
+
+def load_document(html_path=None):
+    """
+    Parsed document of the transcript on html_path
+    """
+    if not html_path:
+        html_path = app_config.TRANSCRIPT_HTML_PATH
+    with open(html_path) as f:
+        html = f.read()
+    return load_html(html, html_path,
+                     get_document_cache(html_path).incremental)
+
+
+class DocumentCache(object):
+    """
+    Parsed document of a transcript kept in memory for the life of
+    the process and refreshed when the file or the authors file changes.
+
+    Only one thread reparses at a time: while it does, other threads
+    are served the previous version, or wait if there is none yet.
+    """
+    def __init__(self, html_path):
+        self.html_path = html_path
+        self.stat = None
+        # (version, parsed document) replaced in a single assignment
+        self.current = (None, None)
+        self.loaded_at = None
+        self.reparses = 0
+        self.hits = 0
+        self.refresh_lock = threading.Lock()
+        self.attachments = {}
+        self.incremental = parse_doc.IncrementalCache()
+
+    @property
+    def version(self):
+        return self.current[0]
+
+    @property
+    def document(self):
+        return self.current[1]
+
+    def _stat(self):
+        st = os.stat(self.html_path)
+        return (st.st_mtime, st.st_size, authors_stamp())
+
+    def get(self):
+        """
+        Current parsed document
+        """
+        return self.get_versioned()[1]
+
+    def get_versioned(self):
+        """
+        Current version and parsed document
+        """
+        stat = self._stat()
+        if stat == self.stat:
+            self.hits += 1
+            return self.current
+        if self.document is not None:
+            if not self.refresh_lock.acquire(False):
+                self.hits += 1
+                return self.current
+        else:
+            self.refresh_lock.acquire()
+        try:
+            self._refresh()
+        finally:
+            self.refresh_lock.release()
+        return self.current
+
+    def peek_version(self):
+        """
+        Version of the transcript on disk, without parsing it
+        """
+        stat = self._stat()
+        if stat == self.stat:
+            return self.version
+        with open(self.html_path) as f:
+            return document_version(f.read(), stat[2])
+
+    def _refresh(self):
+        stat = self._stat()
+        if stat == self.stat:
+            return
+        with open(self.html_path) as f:
+            html = f.read()
+        digest = document_version(html, stat[2])
+        if digest != self.version:
+            document = load_html(html, self.html_path, self.incremental)
+            self.reparses += 1
+            self.current = (digest, document)
+            self.loaded_at = time.time()
+        self.stat = stat
+
+    def attachment(self, name, factory):
+        """
+        Object derived from this document, created by factory on first
+        use and dropped along with the cache
+        """
+        try:
+            return self.attachments[name]
+        except KeyError:
+            return self.attachments.setdefault(name, factory())
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'age': time.time() - self.loaded_at if self.loaded_at else None,
+            'reparses': self.reparses,
+            'hits': self.hits
+        }
+
+
+_document_caches = OrderedDict()
+_document_caches_lock = threading.Lock()
+
+
+def get_document_cache(html_path=None):
+    """
+    DocumentCache of the transcript on html_path shared by the process.
+    Only the DOCUMENT_CACHE_SIZE most recently used are kept
+    """
+    if not html_path:
+        html_path = app_config.TRANSCRIPT_HTML_PATH
+    with _document_caches_lock:
+        cache = _document_caches.pop(html_path, None)
+        if cache is None:
+            cache = DocumentCache(html_path)
+        _document_caches[html_path] = cache
+        while len(_document_caches) > app_config.DOCUMENT_CACHE_SIZE:
+            _document_caches.popitem(last=False)
+    return cache
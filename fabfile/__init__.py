@@ -11,9 +11,12 @@ from fabric.state import env
 from termcolor import colored
 
 import app_config
+import artifacts
+import notifications
 
 # Other fabfiles
 import assets
+import bench
 import daemons
 import data
 import flat
@@ -224,7 +227,7 @@ def deploy(remote='origin', reload=False):
 
 @task
 def deploy_factcheck():
-    render.render_factcheck()
+    version, status = render.render_factcheck()
     flat.deploy_folder(
         app_config.S3_BUCKET,
         '.factcheck',
@@ -232,8 +235,11 @@ def deploy_factcheck():
                   app_config.CURRENT_FACTCHECK),
         headers={
             'Cache-Control': 'max-age=%i' % app_config.DEFAULT_MAX_AGE
-        }
+        },
+        manifest=artifacts.get_manifest()
     )
+    if app_config.LIVE_NOTIFICATIONS:
+        notifications.publish_version(version, status)
 
     if (app_config.DEPLOYMENT_TARGET == 'production' and
             not app_config.DEPLOY_STATIC_FACTCHECK):
@@ -249,7 +255,8 @@ def deploy_embeds():
                   app_config.CURRENT_FACTCHECK),
         headers={
             'Cache-Control': 'max-age=%i' % app_config.DEFAULT_MAX_AGE
-        }
+        },
+        manifest=artifacts.get_manifest()
     )
 
 @task
@@ -0,0 +1,618 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Commands for benchmarking the transcript parser.
+"""
+
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import select
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from urlparse import urlparse
+
+from copydoc import CopyDoc
+from fabric.api import task
+
+import app_config
+import notifications
+import parse_doc
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+# Paragraphs in the shape they take in the live debate transcripts
+DEBATE_PARAGRAPHS = [
+    u'DONALD TRUMP [00:12:41]: We have to bring back jobs. You look at '
+    u'what\'s happening to our country, our jobs are fleeing the country.',
+    u'HILLARY CLINTON [00:14:02]: Well, I think that\'s really important. '
+    u'We have to build an economy that works for everyone, not just those '
+    u'at the top.',
+    u'LESTER HOLT [00:15:10]: Secretary Clinton, two minutes.',
+    u'MIKE PENCE: Senator, you and Hillary Clinton would know a lot about '
+    u'an insult-driven campaign.',
+    u'TIM KAINE [01:02:33]: <strong>Donald Trump has said that he wants to '
+    u'deport 16 million people.</strong> That\'s just not true.',
+    u':[(APPLAUSE)]',
+    u':[(CROSSTALK)]',
+    u'DONALD TRUMP: Wrong. Wrong.',
+    u'And it\'s been going on for a long time, and <strong>we lost 70,000 '
+    u'factories since the WTO</strong> was put in place.',
+    u'(BEGIN VIDEO CLIP)',
+    u'ELAINE QUIJANO [00:47:19]: Governor Pence, you have said that '
+    u'Mr. Trump is a role model for you.',
+    u'We\'re going to have to make this country great again, and the '
+    u'first step is to look at the tax plan.'
+]
+
+
+def _peak_rss():
+    """
+    Peak resident set size of the current process in MB
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OSX reports bytes
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024.0
+
+
+def _run(fn, args, setup, queue):
+    if setup:
+        args = setup(*args)
+    baseline = _peak_rss()
+    start = time.time()
+    fn(*args)
+    elapsed = time.time() - start
+    queue.put((elapsed, _peak_rss(), baseline))
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Run fn in a child process so that peak memory is not shared
+    between measurements. Returns wall time, peak RSS and RSS growth.
+
+    If a setup function is given it is called with args before the
+    measurement starts and its result is used as the arguments of fn.
+    """
+    setup = kwargs.get('setup')
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run,
+                                      args=(fn, args, setup, queue))
+    process.start()
+    elapsed, peak, baseline = queue.get()
+    process.join()
+    return elapsed, peak, peak - baseline
+
+
+def report(name, result):
+    elapsed, peak, growth = result
+    print '%-24s %9.3fs %9.1fMB peak %9.1fMB growth' % (name, elapsed,
+                                                        peak, growth)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _tree_categorize(path):
+    parse_doc.categorize_doc_content(CopyDoc(_read(path)))
+
+
+def _stream_categorize(path):
+    with open(path) as f:
+        for record in parse_doc.StreamingCategorizer(f):
+            pass
+
+
+def _tree_parse(path, authors):
+    parse_doc.parse(CopyDoc(_read(path)), authors)
+
+
+def _stream_parse(path, authors):
+    with open(path) as f:
+        parse_doc.parse(parse_doc.StreamingCategorizer(f), authors)
+
+
+def _legacy_classify(tag):
+    """
+    The regex cascade classify_paragraph replaced, kept as a baseline
+    """
+    text = tag.get_text()
+    contents = unicode(tag)
+    if parse_doc.speaker_regex.match(text):
+        return 'speaker', parse_doc.process_speaker_transcript(contents)
+    elif parse_doc.soundbite_regex.match(text):
+        return 'soundbite', parse_doc.process_soundbite_transcript(contents)
+    else:
+        return 'other', parse_doc.process_other_transcript(contents)
+
+
+def _corpus(path):
+    """
+    Transcript paragraphs from path or the built-in debate paragraphs
+    """
+    if path:
+        html = _read(path)
+    else:
+        html = '<html><body>%s</body></html>' % ''.join(
+            ['<p>%s</p>' % p for p in DEBATE_PARAGRAPHS])
+    raw_contents, status = parse_doc.categorize_doc_content(CopyDoc(html))
+    return [r['content'] for r in raw_contents if r['type'] == 'transcript']
+
+
+def _time(fn, corpus, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        for tag in corpus:
+            fn(tag)
+    return time.time() - start
+
+
+@task
+def classifier(path=None, repeat=2000):
+    """
+    Compare the single pass paragraph classifier with the regex cascade
+    """
+    corpus = _corpus(path)
+    repeat = int(repeat)
+    mismatches = [tag for tag in corpus
+                  if _legacy_classify(tag) !=
+                  parse_doc.process_transcript_content(tag)]
+    for tag in mismatches:
+        logger.warning('Classifiers disagree on: %s' % tag)
+    total = len(corpus) * repeat
+    legacy = _time(_legacy_classify, corpus, repeat)
+    single = _time(parse_doc.process_transcript_content, corpus, repeat)
+    print '%s paragraphs, %s mismatches' % (total, len(mismatches))
+    print '%-24s %9.3fs %9.2fus/paragraph' % ('regex cascade', legacy,
+                                              legacy * 1e6 / total)
+    print '%-24s %9.3fs %9.2fus/paragraph' % ('single pass', single,
+                                              single * 1e6 / total)
+
+
+@task
+def categorizers(path=None):
+    """
+    Compare time and peak memory of the tree and streaming categorizers
+    """
+    if not path:
+        path = app_config.TRANSCRIPT_HTML_PATH
+    authors = parse_doc.get_authors()
+    logger.info('Benchmarking categorizers on %s' % path)
+    report('tree categorize', measure(_tree_categorize, path))
+    report('streaming categorize', measure(_stream_categorize, path))
+    report('tree parse', measure(_tree_parse, path, authors))
+    report('streaming parse', measure(_stream_parse, path, authors))
+
+
+SPEAKERS = ['DONALD TRUMP', 'HILLARY CLINTON', 'LESTER HOLT', 'MIKE PENCE',
+            'TIM KAINE']
+SOUNDBITES = ['APPLAUSE', 'CROSSTALK', 'LAUGHTER', 'BEGIN VIDEO CLIP']
+WORDS = (u'we have to bring back jobs the economy works for everyone tax '
+         u'plan country great again trade deals million people secretary '
+         u'governor senator policy health care plan years').split()
+END_STATES = {
+    'after': u'END',
+    'transcript-end': u'LIVE TRANSCRIPT HAS ENDED',
+    'during': u'DO NOT WRITE BELOW THIS LINE',
+    'error': u'DO NOT WRITE BELOW THIS LINE ERROR'
+}
+
+
+def _gdoc_paragraph(text, bold=None):
+    """
+    Paragraph markup as found on Google Docs html exports
+    """
+    spans = [u'<span style="color:#000000;font-weight:400">%s</span>' % text]
+    if bold:
+        spans.append(u'<span style="color:#000000;font-weight:700">'
+                     u'%s</span>' % bold)
+    return u'<p class="c1"><span></span>%s</p>' % u''.join(spans)
+
+
+def generate_transcript_html(paragraphs=1000, annotation_every=20,
+                             soundbites=0.1, others=0.2, end_state=None,
+                             seed=0):
+    """
+    Build a Google Docs style html export of a transcript with the given
+    number of speaker, soundbite and other paragraphs. An annotation with
+    frontmatter is inserted every annotation_every paragraphs and
+    end_state adds the horizontal rule ending for that status.
+    """
+    rnd = random.Random(seed)
+
+    def sentence(n):
+        return u' '.join(rnd.choice(WORDS) for i in xrange(n)).capitalize()
+
+    body = []
+    for i in xrange(paragraphs):
+        kind = rnd.random()
+        if kind < soundbites:
+            body.append(_gdoc_paragraph(u':[(%s)]' % rnd.choice(SOUNDBITES)))
+        elif kind < soundbites + others:
+            bold = sentence(6) if rnd.random() < 0.2 else None
+            body.append(_gdoc_paragraph(sentence(25), bold))
+        else:
+            timestamp = '%02d:%02d:%02d' % (i / 3600, i / 60 % 60, i % 60)
+            text = u'%s [%s]: %s.' % (rnd.choice(SPEAKERS), timestamp,
+                                      sentence(30))
+            body.append(_gdoc_paragraph(text))
+
+        if annotation_every and i % annotation_every == annotation_every - 1:
+            body.append(_gdoc_paragraph(u'+' * 60))
+            body.append(_gdoc_paragraph(u'---'))
+            body.append(_gdoc_paragraph(u'Slug: annotation-%s' % i))
+            published = 'Yes' if rnd.random() < 0.9 else 'No'
+            body.append(_gdoc_paragraph(u'Published: %s' % published))
+            body.append(_gdoc_paragraph(u'Author: Domenico Montanaro (dm)'))
+            body.append(_gdoc_paragraph(u'Prior: %s' % rnd.randint(1, 3)))
+            body.append(_gdoc_paragraph(u'---'))
+            for j in xrange(rnd.randint(1, 3)):
+                body.append(_gdoc_paragraph(sentence(40)))
+            body.append(_gdoc_paragraph(u'-' * 60))
+
+    if end_state:
+        body.append(u'<hr style="page-break-before:always;display:none;">')
+        body.append(_gdoc_paragraph(END_STATES[end_state]))
+
+    html = (u'<html><head><meta content="text/html; charset=UTF-8" '
+            u'http-equiv="content-type"><style type="text/css">'
+            u'.c1{padding-top:0pt}</style></head>'
+            u'<body class="c2">%s</body></html>' % u''.join(body))
+    return html.encode('utf-8')
+
+
+@task
+def generate(paragraphs=1000, path=None, end_state='during'):
+    """
+    Write a synthetic transcript to path, a temporary file by default.
+    It is never written over the live transcript
+    """
+    html = generate_transcript_html(int(paragraphs), end_state=end_state)
+    if not path:
+        fd, path = tempfile.mkstemp(prefix='transcript-', suffix='.html')
+        os.close(fd)
+    elif (os.path.abspath(path) ==
+            os.path.abspath(app_config.TRANSCRIPT_HTML_PATH)):
+        raise ValueError('Not writing a synthetic transcript over %s' %
+                         app_config.TRANSCRIPT_HTML_PATH)
+    with open(path, 'w') as f:
+        f.write(html)
+    logger.info('Wrote %s paragraphs to %s' % (paragraphs, path))
+    return path
+
+
+def _setup_doc(path):
+    return (CopyDoc(_read(path)),)
+
+
+def _setup_raw_contents(path, authors):
+    raw_contents, status = parse_doc.categorize_doc_content(
+        CopyDoc(_read(path)))
+    return raw_contents, status, authors
+
+
+def _setup_html(path, authors):
+    return _read(path), authors
+
+
+def _full_parse(html, authors):
+    parse_doc.parse(CopyDoc(html), authors)
+
+
+def _serial_records(raw_contents, status, authors):
+    parse_doc.parse_raw_contents(raw_contents, status, authors,
+                                 parallel=False)
+
+
+def _parallel_records(raw_contents, status, authors):
+    parse_doc.parse_raw_contents(raw_contents, status, authors,
+                                 parallel=True)
+
+
+def _incremental_parse(html, authors):
+    """
+    Parse once to warm up, then time the parse of the next version
+    """
+    incremental = parse_doc.IncrementalCache()
+    parse_doc.parse(CopyDoc(html), authors, incremental=incremental)
+    appended = html.replace('</body>', '%s</body>' % _gdoc_paragraph(
+        u'DONALD TRUMP [99:00:00]: One more paragraph.'))
+    start = time.time()
+    parse_doc.parse(CopyDoc(appended), authors, incremental=incremental)
+    logger.info('Incremental cycle took %.3fs' % (time.time() - start))
+
+
+@task
+def suite(sizes='1000/10000/50000'):
+    """
+    Time and peak memory of the parser phases for several document sizes,
+    separate sizes with slashes
+    """
+    authors = parse_doc.get_authors()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for size in [int(x) for x in sizes.split('/')]:
+            path = os.path.join(tmpdir, 'transcript-%s.html' % size)
+            with open(path, 'w') as f:
+                f.write(generate_transcript_html(size, end_state='during'))
+            print '%s paragraphs (%.1fMB)' % (
+                size, os.path.getsize(path) / 1024.0 / 1024.0)
+            report('categorize_doc_content',
+                   measure(parse_doc.categorize_doc_content, path,
+                           setup=_setup_doc))
+            report('parse_raw_contents',
+                   measure(_serial_records, path, authors,
+                           setup=_setup_raw_contents))
+            report('parallel raw contents',
+                   measure(_parallel_records, path, authors,
+                           setup=_setup_raw_contents))
+            report('parse',
+                   measure(_full_parse, path, authors, setup=_setup_html))
+            report('streaming parse',
+                   measure(_stream_parse, path, authors))
+            report('incremental parse',
+                   measure(_incremental_parse, path, authors,
+                           setup=_setup_html))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _deep_size(obj, seen=None):
+    """
+    Approximate memory held by obj counting shared objects once
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += _deep_size(k, seen) + _deep_size(v, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += _deep_size(item, seen)
+    elif isinstance(obj, parse_doc.Record):
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                size += _deep_size(getattr(obj, slot, None), seen)
+    return size
+
+
+def _measure_memory(build):
+    """
+    Bytes allocated by build, using tracemalloc where available
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return _deep_size(build())
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+@task
+def records(paragraphs=10000):
+    """
+    Compare the memory held by parsed records and the dicts they replaced,
+    counting the fragment cache that holds the markup of rendered records
+    """
+    html = generate_transcript_html(int(paragraphs))
+    contents = parse_doc.parse(CopyDoc(html),
+                               parse_doc.get_authors())['contents']
+    serialized = [(type(r), r.__getstate__()) for r in contents]
+
+    def build_records():
+        result = []
+        for cls, state in serialized:
+            record = cls.__new__(cls)
+            record.__setstate__(dict(state))
+            result.append(record)
+        return result
+
+    def build_dicts():
+        return [r.as_dict() for r in build_records()]
+
+    def build_rendered():
+        parse_doc.fragment_cache.clear()
+        result = build_records()
+        for record in result:
+            record.markup
+        return result, parse_doc.fragment_cache.fragments
+
+    legacy = _measure_memory(build_dicts)
+    compact = _measure_memory(build_records)
+    rendered = _measure_memory(build_rendered)
+    print '%s records' % len(contents)
+    print '%-30s %9.1fMB' % ('dicts with markup', legacy / 1024.0 / 1024.0)
+    print '%-30s %9.1fMB' % ('records before rendering',
+                             compact / 1024.0 / 1024.0)
+    print '%-30s %9.1fMB' % ('rendered records and cache',
+                             rendered / 1024.0 / 1024.0)
+
+
+def _raise_open_files_limit(wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(wanted, hard)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+@task
+def connections(url=None, connections=2000, hold=60, notify=False):
+    """
+    Hold idle connections to a live notification endpoint and report
+    how many the server kept open. With notify, publish a new version
+    halfway through and time how long it takes to reach every client
+    (the server must watch the PUBLISHED_VERSION_PATH of this checkout)
+    """
+    if not url:
+        url = 'http://127.0.0.1:8000/%s/live/events' % app_config.PROJECT_SLUG
+    connections = int(connections)
+    hold = float(hold)
+    parsed = urlparse(url)
+    path = parsed.path
+    if parsed.query:
+        path = '%s?%s' % (path, parsed.query)
+    request = ('GET %s HTTP/1.1\r\nHost: %s\r\n'
+               'Accept: text/event-stream, application/json\r\n\r\n' % (
+                   path, parsed.netloc))
+
+    limit = _raise_open_files_limit(connections + 64)
+    if limit < connections + 64:
+        print 'Open files limit is %s, some connections will fail' % limit
+
+    poller = select.epoll()
+    sockets = {}
+    failed = 0
+    start = time.time()
+    for i in xrange(connections):
+        try:
+            s = socket.create_connection((parsed.hostname, parsed.port or 80),
+                                         timeout=10)
+            s.sendall(request)
+            s.setblocking(0)
+        except (socket.error, socket.timeout):
+            failed += 1
+            continue
+        sockets[s.fileno()] = s
+        poller.register(s.fileno(), select.EPOLLIN)
+    print '%s connected, %s failed in %.1fs' % (len(sockets), failed,
+                                                time.time() - start)
+
+    closed = 0
+    responses = 0
+    notified = {}
+    version = None
+    published_at = None
+    hold_start = time.time()
+    end = hold_start + hold
+    while time.time() < end and sockets:
+        if (notify and published_at is None and
+                time.time() > hold_start + hold / 2):
+            version = 'loadtest-%i' % time.time()
+            notifications.publish_version(version, 'during')
+            published_at = time.time()
+        for fd, event in poller.poll(0.5):
+            s = sockets[fd]
+            try:
+                data = s.recv(65536)
+            except socket.error:
+                data = ''
+            if not data:
+                closed += 1
+                poller.unregister(fd)
+                s.close()
+                del sockets[fd]
+                continue
+            responses += 1
+            if version and version in data and fd not in notified:
+                notified[fd] = time.time() - published_at
+
+    print '%s connections open after %.0fs, %s closed by the server' % (
+        len(sockets), hold, closed)
+    print '%s reads' % responses
+    if published_at:
+        latencies = sorted(notified.values())
+        if latencies:
+            print '%s clients notified, median %.3fs, last %.3fs' % (
+                len(latencies), latencies[len(latencies) / 2], latencies[-1])
+        else:
+            print 'No client was notified'
+    for s in sockets.values():
+        s.close()
+
+
+def _legacy_make_context():
+    """
+    make_context and the config copy of get_factcheck_context
+    before the configuration snapshot
+    """
+    from render_utils import CSSIncluder, JavascriptIncluder
+    context = {}
+    for k, v in app_config.__dict__.items():
+        if k.upper() == k:
+            context[k] = v
+    context['JS'] = JavascriptIncluder()
+    context['CSS'] = CSSIncluder()
+    config = {}
+    for k, v in app_config.__dict__.items():
+        if k.upper() == k:
+            config[k] = v
+    context['config'] = config
+    return context
+
+
+def _snapshot_make_context():
+    from render_utils import get_app_config, make_context
+    context = make_context()
+    context['config'] = get_app_config()
+    return context
+
+
+def _context_allocations(build):
+    """
+    Bytes of the containers a context build allocates, the values
+    themselves are shared with app_config
+    """
+    from render_utils import get_app_config
+    context = build()
+    size = sys.getsizeof(context)
+    if hasattr(context, 'variables'):
+        size += sys.getsizeof(context.variables)
+    if context['config'] is not get_app_config():
+        size += sys.getsizeof(context['config'])
+    for includer in (context['JS'], context['CSS']):
+        size += sys.getsizeof(includer) + sys.getsizeof(includer.__dict__)
+    return size
+
+
+@task
+def contexts(repeat=20000):
+    """
+    Compare the time and memory allocated per request to build
+    the template context of the factcheck views
+    """
+    import json
+    from render_utils import BetterJSONEncoder, get_app_config_js
+
+    def legacy_js():
+        config = dict((k, v) for k, v in app_config.__dict__.items()
+                      if k.upper() == k)
+        return 'window.APP_CONFIG = ' + json.dumps(config,
+                                                   cls=BetterJSONEncoder)
+
+    repeat = int(repeat)
+    rows = [
+        ('legacy context', _legacy_make_context,
+         _context_allocations(_legacy_make_context)),
+        ('snapshot context', _snapshot_make_context,
+         _context_allocations(_snapshot_make_context)),
+        ('legacy app_config.js', legacy_js, len(legacy_js())),
+        ('snapshot app_config.js', get_app_config_js, 0)
+    ]
+    print '%-24s %12s %14s' % ('', 'us/request', 'bytes/request')
+    for name, fn, allocated in rows:
+        start = time.time()
+        for i in xrange(repeat):
+            fn()
+        elapsed = (time.time() - start) / repeat
+        print '%-24s %12.1f %14s' % (name, elapsed * 1e6, allocated)
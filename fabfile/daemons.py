@@ -5,7 +5,9 @@ from time import sleep, time
 from fabric.api import execute, require, settings, task
 
 import app_config
+import instrumentation
 import logging
+import parse_doc
 import sys
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
@@ -43,13 +45,31 @@ def main(run_once=False):
         if (now - copy_start) > app_config.LOAD_COPY_INTERVAL:
             cycle += 1
             copy_start = now
+            instrumentation.start_cycle()
             logger.info('Update transcript')
             execute('text.get_transcript')
+            if app_config.DOCUMENTS:
+                execute('text.get_documents')
             if app_config.DEPLOYMENT_TARGET:
                 execute('deploy_factcheck')
                 execute('deploy_embeds')
+                update_fragment_cache()
+            instrumentation.end_cycle()
             if (cycle % app_config.REFRESH_AUTHOR_CYCLES == 0):
                 logger.info('Update authors file')
                 cycle = 0
                 execute('text.update')
         sleep(1)
+
+
+def update_fragment_cache():
+    """
+    Log the rendered fragment cache usage of the cycle and persist it
+    """
+    cache = parse_doc.fragment_cache
+    stats = cache.stats()
+    logger.info('Fragment cache: %(hits)s hits, %(misses)s misses, '
+                '%(evictions)s evictions, %(size)s fragments, '
+                '%(saved_time).3fs render time saved' % stats)
+    cache.reset_stats()
+    cache.save()
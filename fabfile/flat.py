@@ -12,6 +12,7 @@ import os
 from boto.s3.key import Key
 
 import app_config
+import instrumentation
 import utils
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
@@ -30,6 +31,7 @@ class FakeTime:
 gzip.time = FakeTime()
 
 
+@instrumentation.timed('upload')
 def deploy_file(bucket, src, dst, headers={}, public=True):
     """
     Deploy a single file to S3, if the local version is different.
@@ -72,9 +74,12 @@ def deploy_file(bucket, src, dst, headers={}, public=True):
 
         if local_md5 == s3_md5:
             logger.info('Skipping %s (has not changed)' % src)
+            instrumentation.incr('upload_skipped')
         else:
             logger.info('Uploading %s --> %s (gzipped)' % (src, dst))
             k.set_contents_from_string(output.getvalue(), file_headers, policy=policy)
+            instrumentation.incr('uploaded')
+            instrumentation.incr('uploaded_bytes', len(output.getvalue()))
     # Non-gzip file
     else:
         with open(src, 'rb') as f:
@@ -84,41 +89,92 @@ def deploy_file(bucket, src, dst, headers={}, public=True):
 
         if local_md5 == s3_md5:
             logger.info('Skipping %s (has not changed)' % src)
+            instrumentation.incr('upload_skipped')
         else:
             logger.info('Uploading %s --> %s' % (src, dst))
             k.set_contents_from_filename(src, file_headers, policy=policy)
+            instrumentation.incr('uploaded')
+            instrumentation.incr('uploaded_bytes', os.path.getsize(src))
 
-def deploy_folder(bucket_name, src, dst, headers={}, ignore=[]):
+def _walk_folder(src):
+    for local_path, subdirs, filenames in os.walk(src, topdown=True):
+        for name in filenames:
+            yield os.path.join(local_path, name)
+
+
+def files_to_deploy(src, dst, ignore=[], src_paths=None):
     """
-    Deploy a folder to S3, checking each file to see if it has changed.
+    Source and destination paths of the files to deploy from src: the
+    existing ones among src_paths if given, otherwise every file in
+    the folder.
     """
-    to_deploy = []
+    if src_paths is not None:
+        src_paths = [src_path for src_path in src_paths
+                     if os.path.exists(src_path)]
+    else:
+        src_paths = _walk_folder(src)
 
-    for local_path, subdirs, filenames in os.walk(src, topdown=True):
-        rel_path = os.path.relpath(local_path, src)
+    return _destinations(src, dst, src_paths, ignore)
 
-        for name in filenames:
-            if name.startswith('.'):
-                continue
 
-            src_path = os.path.join(local_path, name)
+def files_to_delete(src, dst, src_paths, ignore=[]):
+    """
+    Destination paths of the files removed from src among src_paths
+    """
+    src_paths = [src_path for src_path in src_paths
+                 if not os.path.exists(src_path)]
+    return [dst_path for src_path, dst_path
+            in _destinations(src, dst, src_paths, ignore)]
+
 
-            skip = False
+def _destinations(src, dst, src_paths, ignore):
+    destinations = []
 
-            for pattern in ignore:
-                if fnmatch(src_path, pattern):
-                    skip = True
-                    break
+    for src_path in src_paths:
+        name = os.path.basename(src_path)
+        if name.startswith('.'):
+            continue
 
-            if skip:
-                continue
+        skip = False
 
-            if rel_path == '.':
-                dst_path = os.path.join(dst, name)
-            else:
-                dst_path = os.path.join(dst, rel_path, name)
+        for pattern in ignore:
+            if fnmatch(src_path, pattern):
+                skip = True
+                break
 
-            to_deploy.append((src_path, dst_path))
+        if skip:
+            continue
+
+        rel_path = os.path.relpath(os.path.dirname(src_path), src)
+
+        if rel_path == '.':
+            dst_path = os.path.join(dst, name)
+        else:
+            dst_path = os.path.join(dst, rel_path, name)
+
+        destinations.append((src_path, dst_path))
+
+    return destinations
+
+
+def deploy_folder(bucket_name, src, dst, headers={}, ignore=[],
+                  manifest=None):
+    """
+    Deploy a folder to S3, checking each file to see if it has changed.
+
+    Pass the artifacts.ChangeManifest the folder was rendered with to
+    only deploy the files written since the previous deploy to the same
+    bucket and destination, and delete the ones removed since.
+    """
+    src_paths = None
+    removed = []
+    if manifest is not None:
+        # Merge the changes saved by the other processes first
+        manifest.save()
+        sequence, src_paths, removed = manifest.pending(src, bucket_name,
+                                                        dst)
+    to_deploy = files_to_deploy(src, dst, ignore, src_paths)
+    to_delete = files_to_delete(src, dst, removed, ignore)
 
     if bucket_name == app_config.STAGING_S3_BUCKET:
         public = False
@@ -126,8 +182,16 @@ def deploy_folder(bucket_name, src, dst, headers={}, ignore=[]):
         public = True
     bucket = utils.get_bucket(bucket_name)
     logger.info(dst)
-    for src, dst in to_deploy:
-        deploy_file(bucket, src, dst, headers, public=public)
+    for src_path, dst_path in to_deploy:
+        deploy_file(bucket, src_path, dst_path, headers, public=public)
+    for dst_path in to_delete:
+        logger.info('Deleting %s' % dst_path)
+        bucket.delete_key(dst_path)
+        instrumentation.incr('deleted')
+
+    if manifest is not None:
+        manifest.deployed(src, bucket_name, dst, sequence)
+        manifest.save()
 
 
 def delete_folder(bucket_name, dst):
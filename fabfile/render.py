@@ -4,15 +4,24 @@
 Commands for rendering various parts of the app stack.
 """
 
-import codecs
 from glob import glob
+import hashlib
+import json
 import logging
 import os
+import time
+from multiprocessing.pool import ThreadPool
 
 from fabric.api import local, task
 
 import app
 import app_config
+import artifacts
+import deltas
+import documents
+import instrumentation
+import render_engine
+from render_utils import get_app_config_js
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
@@ -39,6 +48,37 @@ def _view_from_name(name):
 
     return globals()[module].__dict__[name]
 
+def _workers(workers=None):
+    """
+    Number of render threads, fab passes task arguments as strings.
+    """
+    if workers is None:
+        workers = app_config.RENDER_WORKERS
+    return max(int(workers or 1), 1)
+
+def _map(func, jobs, workers):
+    """
+    Run func over jobs on a pool of threads, or in this thread if only
+    one worker is requested. Results keep the order of the jobs.
+    """
+    if workers == 1 or len(jobs) < 2:
+        return map(func, jobs)
+
+    pool = ThreadPool(min(workers, len(jobs)))
+    try:
+        return pool.map(func, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def _report_timings(title, timings, elapsed):
+    """
+    Print the time taken by each rendered file, slowest first.
+    """
+    print '%s: %i files in %.2fs' % (title, len(timings), elapsed)
+    for filename, duration in sorted(timings, key=lambda t: -t[1]):
+        print '  %8.1fms  %s' % (duration * 1000, filename)
+
 @task
 def less():
     """
@@ -75,8 +115,8 @@ def app_config_js():
     with _fake_context('/js/app_config.js'):
         response = _app_config_js()
 
-    with open('www/js/app_config.js', 'w') as f:
-        f.write(response.data)
+    artifacts.write_file('www/js/app_config.js', response.data)
+    artifacts.get_manifest().save()
 
 @task
 def copytext_js():
@@ -88,23 +128,14 @@ def copytext_js():
     with _fake_context('/js/copytext.js'):
         response = _copy_js()
 
-    with open('www/js/copy.js', 'w') as f:
-        f.write(response.data)
+    artifacts.write_file('www/js/copy.js', response.data)
+    artifacts.get_manifest().save()
 
-@task(default=True)
-def render_all():
+def _view_jobs():
     """
-    Render HTML templates and compile assets.
+    Views of the app rendered to www, as (endpoint, rule, filename).
     """
-    from flask import g
-
-    less()
-    jst()
-    app_config_js()
-
-    local('npm run build')
-
-    compiled_includes = {}
+    jobs = []
 
     # Loop over all views in the app
     for rule in app.app.url_map.iter_rules():
@@ -125,30 +156,71 @@ def render_all():
             logger.info('Skipping %s' % name)
             continue
 
-        # Create the output path
+        jobs.append((name, rule_string, filename))
+
+    return jobs
+
+@task
+def render_views(workers=None):
+    """
+    Render the views of the app to www, compiling their assets once.
+    """
+    from flask import g
+
+    jobs = _view_jobs()
+
+    # Create the output paths before the workers start
+    for name, rule_string, filename in jobs:
         dirname = os.path.dirname(filename)
 
         if not (os.path.exists(dirname)):
             os.makedirs(dirname)
 
+    # Shared by every worker so that assets are compiled once and all
+    # views link them with the same querystring
+    compiled_includes = {}
+    includes_timestamp = int(time.time())
+
+    def render_view(job):
+        name, rule_string, filename = job
+        start = time.time()
+
         logger.info('Rendering %s' % (filename))
 
         # Render views, reusing compiled assets
         with _fake_context(rule_string):
             g.compile_includes = True
             g.compiled_includes = compiled_includes
+            g.includes_timestamp = includes_timestamp
 
             view = _view_from_name(name)
 
             content = view().data
 
-            compiled_includes = g.compiled_includes
-
         # Write rendered view
         # NB: Flask response object has utf-8 encoded the data
-        with open(filename, 'w') as f:
-            f.write(content)
-    render_embeds()
+        artifacts.write_file(filename, content)
+
+        return filename, time.time() - start
+
+    start = time.time()
+    timings = _map(render_view, jobs, _workers(workers))
+    artifacts.get_manifest().save()
+    _report_timings('Views', timings, time.time() - start)
+
+@task(default=True)
+def render_all(workers=None):
+    """
+    Render HTML templates and compile assets.
+    """
+    less()
+    jst()
+    app_config_js()
+
+    local('npm run build')
+
+    render_views(workers)
+    render_embeds(workers)
 
 
 @task
@@ -162,78 +234,199 @@ def render_copydoc():
         view = app.__dict__[view_name]
         response = view()
 
-    try:
-        os.makedirs('.copydoc/')
-    except OSError:
-        pass
+    artifacts.write_file('.copydoc/{0}'.format(path), response.data)
+    artifacts.get_manifest().save()
 
-    with codecs.open('.copydoc/{0}'.format(path), 'w', 'utf-8') as f:
-        f.write(response.data.decode('utf-8'))
 
+_view_paths = {}
 
-def generate_views(views, parsed_factcheck):
-    from flask import url_for, g
+def _view_path(view_name):
+    """
+    Path of a view, resolved once without a request context.
+    """
+    try:
+        return _view_paths[view_name]
+    except KeyError:
+        path = app.app.url_map.bind('').build(view_name)
+        return _view_paths.setdefault(view_name, path)
 
-    view_paths = []
-    with app.app.test_request_context():
-        for view_name in views:
-            path = url_for(view_name)
-            view_paths.append((view_name, path))
+def _factcheck_context(parsed_factcheck):
+    return app.engine.context(parsed_factcheck,
+                              app.delta_history.add(parsed_factcheck))
 
-    for view_name, path in view_paths:
-        logger.info("%s, %s" % (view_name, path))
-        with _fake_context(path):
-            # add parsed liveblog to g
-            g.parsed_factcheck = parsed_factcheck
-            logger.info(path)
-            view = app.__dict__[view_name]
-            response = view()
+@instrumentation.timed('render_views')
+def generate_views(views, parsed_factcheck):
+    context = _factcheck_context(parsed_factcheck)
 
-            try:
-                os.makedirs('.factcheck/')
-            except OSError:
-                pass
+    for view_name in views:
+        path = _view_path(view_name)
+        logger.info("%s, %s" % (view_name, path))
+        artifacts.write_file('.factcheck/{0}'.format(path),
+                             app.engine.page(view_name, context))
 
-            with codecs.open('.factcheck/{0}'.format(path), 'w', 'utf-8') as f:
-                f.write(response.data.decode('utf-8'))
+    artifacts.get_manifest().save()
 
 
+@instrumentation.timed('parse')
 def parse_factcheck():
-    with open(app_config.TRANSCRIPT_HTML_PATH) as f:
-        html = f.read()
-    parsed_factcheck = app.parse_document(html)
+    parsed_factcheck = documents.load_document(app_config.TRANSCRIPT_HTML_PATH)
     return parsed_factcheck
 
 
 @task
 def render_factcheck():
+    """
+    Render the factcheck views, returning the version of the
+    published transcript and its status
+    """
     parsed_factcheck = parse_factcheck()
     generate_views(['_factcheck', '_preview', '_share'],
                    parsed_factcheck)
+    if app_config.RENDER_DELTAS:
+        render_deltas(parsed_factcheck)
+    return (app.delta_history.add(parsed_factcheck),
+            parsed_factcheck['status'])
+
+
+@task
+def render_deltas(parsed_factcheck=None):
+    """
+    Render the changes to the published transcript since each version
+    in the history to .factcheck/live-data/deltas/<version>.json and
+    the current version to .factcheck/live-data/version.json
+    """
+    if parsed_factcheck is None:
+        parsed_factcheck = parse_factcheck()
+    history = deltas.DeltaHistory(app_config.DELTA_HISTORY_SIZE,
+                                  app_config.DELTA_HISTORY_PATH)
+    previous = history.latest
+    version = history.add(parsed_factcheck)
+    deltas_path = '.factcheck/live-data/deltas'
+    if version == previous and os.path.exists(deltas_path):
+        return
+
+    try:
+        os.makedirs(deltas_path)
+    except OSError:
+        pass
+
+    for path in glob('%s/*.json' % deltas_path):
+        since = os.path.splitext(os.path.basename(path))[0]
+        if since not in history.versions:
+            artifacts.remove_file(path)
+
+    for since in history.versions:
+        artifacts.write_file('%s/%s.json' % (deltas_path, since),
+                             json.dumps(history.delta(since, version)))
+
+    artifacts.write_file('.factcheck/live-data/version.json', json.dumps(
+        {'version': version, 'status': parsed_factcheck['status']}))
+
+    history.save()
+    artifacts.get_manifest().save()
+    logger.info('Rendered deltas to version %s from %s versions' % (
+                version, len(history.versions)))
+
+def _embeds_fingerprint():
+    """
+    Inputs shared by every embed: the templates and the configuration.
+    """
+    fingerprint, last_modified = app.get_templates_fingerprint()
+    return hashlib.sha1(
+        fingerprint + get_app_config_js()).hexdigest()
+
+def _embed_digest(fingerprint, slug, markups):
+    h = hashlib.sha1(fingerprint)
+    h.update(slug.encode('utf-8'))
+    for markup in markups:
+        h.update('\0')
+        h.update(markup.encode('utf-8'))
+    return h.hexdigest()
+
+def embed_digests(parsed_factcheck):
+    """
+    Digest of the inputs of each embed: its annotation and the prior
+    paragraphs shown before it. The embed list is stored under None
+    and depends on the published slugs.
+    """
+    fingerprint = _embeds_fingerprint()
+    contents = parsed_factcheck['contents']
+    embeds = parsed_factcheck['embeds']
+    digests = {None: _embed_digest(fingerprint, u'', embeds.keys())}
+    for slug, (index, annotation) in embeds.iteritems():
+        prior = render_engine.get_embed_prior(contents, index, annotation)
+        markups = [post['markup'] for post in prior]
+        markups.append(annotation['markup'])
+        digests[slug] = _embed_digest(fingerprint, slug, markups)
+    return digests
+
+def _read_embeds_manifest():
+    try:
+        with open(app_config.EMBEDS_MANIFEST_PATH) as f:
+            return dict((slug or None, digest)
+                        for slug, digest in json.load(f).iteritems())
+    except (IOError, ValueError):
+        return {}
+
+def _write_embeds_manifest(digests):
+    path = app_config.EMBEDS_MANIFEST_PATH
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+        json.dump(dict((slug or '', digest)
+                       for slug, digest in digests.iteritems()), f)
+    os.rename(tmp_path, path)
+
+def _embed_filename(slug):
+    if slug is None:
+        return './www/embeds/index.html'
+    return './www/embeds/{0}.html'.format(slug)
 
 @task
-def render_embeds():
+@instrumentation.timed('render_embeds')
+def render_embeds(workers=None, force=False):
+    """
+    Render the embeds whose annotation or prior paragraphs changed since
+    the last run and remove the embeds of unpublished annotations.
+    """
+    # Task arguments are strings on the command line
+    force = force in (True, 'True', 'true', '1')
+
     try:
         os.makedirs('./www/embeds')
     except OSError:
         pass
 
     parsed_factcheck = parse_factcheck()
-    from flask import g, url_for
-    view = app.__dict__['_embed']
-    contents = parsed_factcheck['contents']
-    annotations = [x for x in contents if x['type'] == 'annotation']
-    published = [x for x in annotations if x['published'] == 'yes']
-    slugs = [x['slug'] for x in published]
-    with _fake_context('/embeds/'):
-        g.slugs = slugs
-        response = app.__dict__['_embedlist']()
-        with open('./www/embeds/index.html', 'w') as f:
-            f.write(response.data)
-    for slug in slugs:
-        path = '{0}/embed'.format(slug) #url_for('_embed', slug=slug)
-        with _fake_context(path):
-            g.parsed_factcheck = parsed_factcheck
-            response = view(slug)
-            with open('./www/embeds/{0}.html'.format(slug), 'w') as f:
-                f.write(response.data)
\ No newline at end of file
+    context = _factcheck_context(parsed_factcheck)
+
+    digests = embed_digests(parsed_factcheck)
+    manifest = {} if force else _read_embeds_manifest()
+
+    for filename in glob('./www/embeds/*.html'):
+        slug = os.path.splitext(os.path.basename(filename))[0]
+        if slug != 'index' and slug not in digests:
+            logger.info('Removing unpublished embed %s' % filename)
+            artifacts.remove_file(filename)
+
+    slugs = [slug for slug in [None] + parsed_factcheck['embeds'].keys()
+             if manifest.get(slug) != digests[slug] or
+             not os.path.exists(_embed_filename(slug))]
+
+    def render_embed(slug):
+        start = time.time()
+        filename = _embed_filename(slug)
+        if slug is None:
+            page = app.engine.embedlist(context)
+        else:
+            page = app.engine.embed(context, slug)
+        artifacts.write_file(filename, page)
+        return filename, time.time() - start
+
+    start = time.time()
+    timings = _map(render_embed, slugs, _workers(workers))
+    _write_embeds_manifest(digests)
+    instrumentation.incr('embeds_rendered', len(slugs))
+    instrumentation.incr('embeds_unchanged', len(digests) - len(slugs))
+    artifacts.get_manifest().save()
+    _report_timings('Embeds (%i unchanged)' % (len(digests) - len(slugs)),
+                    timings, time.time() - start)
@@ -5,7 +5,11 @@ Commands related to syncing copytext from Google Docs.
 """
 
 import app_config
+import documents
+import instrumentation
 import logging
+import os
+import parse_doc
 
 from fabric.api import task
 from oauth import get_document, get_credentials, get_doc
@@ -31,11 +35,30 @@ def update():
         return
 
     get_document(app_config.AUTHORS_GOOGLE_DOC_KEY, app_config.AUTHORS_PATH)
+    # Reload the cached authors dictionary once per download
+    parse_doc.get_authors()
 
 
 @task
+@instrumentation.timed('fetch')
 def get_transcript():
     gdoc = app_config.TRANSCRIPT_GDOC_KEY
     path = app_config.TRANSCRIPT_HTML_PATH
     if gdoc:
         get_doc(gdoc, path)
+
+
+@task
+@instrumentation.timed('fetch_documents')
+def get_documents():
+    """
+    Download the transcripts of DOCUMENTS served under /docs/<key>/
+    """
+    if not os.path.exists(app_config.DOCUMENTS_PATH):
+        os.makedirs(app_config.DOCUMENTS_PATH)
+    for key, gdoc in app_config.DOCUMENTS.items():
+        path = documents.document_path(key)
+        if path is None:
+            logger.error('Invalid document key %s' % key)
+            continue
+        get_doc(gdoc, path)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Bounded cache of rendered jinja fragments.
+"""
+import cPickle as pickle
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+CACHE_FORMAT_VERSION = 1
+
+
+class FragmentCache(object):
+    """
+    LRU cache of rendered templates keyed by template name,
+    template modification time and the canonicalized render context.
+
+    If a path is given the cache can be saved to and restored from disk
+    so that a restarted process starts warm.
+    """
+    def __init__(self, env, max_size=10000, path=None):
+        self.env = env
+        self.max_size = max_size
+        self.path = path
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+        # template name -> (template, mtime)
+        self._templates = {}
+        self.dirty = False
+        self.reset_stats()
+        if path:
+            self.load()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.render_time = 0.0
+
+    def _template_mtime(self, template):
+        """
+        Jinja creates a new template object when the source changes
+        so we only need to stat the file once per template object
+        """
+        cached = self._templates.get(template.name)
+        if cached and cached[0] is template:
+            return cached[1]
+        try:
+            mtime = os.path.getmtime(template.filename)
+        except (OSError, TypeError):
+            mtime = None
+        self._templates[template.name] = (template, mtime)
+        return mtime
+
+    def make_key(self, template, context):
+        canonical = json.dumps(context, sort_keys=True, default=unicode)
+        raw = u'%s:%s:%s' % (template.name,
+                             self._template_mtime(template),
+                             canonical)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def render(self, template_name, context):
+        """
+        Render template_name with context reusing a previous render if found
+        """
+        template = self.env.get_template(template_name)
+        key = self.make_key(template, context)
+        with self.lock:
+            markup = self.fragments.pop(key, None)
+            if markup is not None:
+                self.fragments[key] = markup
+                self.hits += 1
+                return markup
+
+        start = time.time()
+        markup = template.render(**context)
+        elapsed = time.time() - start
+
+        with self.lock:
+            self.misses += 1
+            self.render_time += elapsed
+            self.fragments[key] = markup
+            self.dirty = True
+            while len(self.fragments) > self.max_size:
+                self.fragments.popitem(last=False)
+                self.evictions += 1
+        return markup
+
+    def stats(self):
+        """
+        Counters since the last reset, saved time is estimated
+        from the average render time of the misses
+        """
+        lookups = self.hits + self.misses
+        if self.misses:
+            saved = self.hits * self.render_time / self.misses
+        else:
+            saved = 0.0
+        return {
+            'size': len(self.fragments),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'render_time': self.render_time,
+            'saved_time': saved
+        }
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
+            self.dirty = True
+
+    def load(self):
+        """
+        Restore fragments persisted by a previous process
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except IOError:
+            return
+        except Exception, e:
+            logger.warning('Could not load fragment cache %s: %s' % (
+                           self.path, e))
+            return
+        if data.get('version') != CACHE_FORMAT_VERSION:
+            return
+        with self.lock:
+            for key, markup in data['fragments']:
+                self.fragments[key] = markup
+            while len(self.fragments) > self.max_size:
+                self.fragments.popitem(last=False)
+        logger.info('Loaded %s fragments from %s' % (len(self.fragments),
+                                                     self.path))
+
+    def save(self):
+        """
+        Persist fragments to disk, replacing the previous file atomically
+        """
+        if not self.path or not self.dirty:
+            return
+        with self.lock:
+            data = {
+                'version': CACHE_FORMAT_VERSION,
+                'fragments': self.fragments.items()
+            }
+            self.dirty = False
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
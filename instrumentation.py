@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Time spent in each phase of the fetch, parse, render and upload
+pipeline of the daemon.
+
+Phases are timed with the timed decorator or the timer context manager
+and events are counted with incr. Each daemon cycle ends with
+end_cycle, which writes the totals of the cycle as a json line and
+keeps them to summarize the latest cycles. When INSTRUMENTATION is off
+timers and counters only check the setting.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of values
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, recorder, phase):
+        self.recorder = recorder
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_time(self.phase, time.time() - self.start)
+        return False
+
+
+class Recorder(object):
+    """
+    Phase timings and counters of the current cycle and the phase
+    totals of the last window cycles
+    """
+    def __init__(self, window=100):
+        self.lock = threading.Lock()
+        self.window = window
+        self.cycles = 0
+        self.history = {}
+        self._reset()
+
+    def start_cycle(self):
+        with self.lock:
+            self._reset()
+
+    def _reset(self):
+        self.started_at = time.time()
+        self.phases = {}
+        self.counters = {}
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            count, total = self.phases.get(phase, (0, 0.0))
+            self.phases[phase] = (count + 1, total + seconds)
+
+    def incr(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def end_cycle(self, **extra):
+        """
+        Totals of the cycle as a dict, starting a new cycle
+        """
+        with self.lock:
+            self.cycles += 1
+            record = {
+                'cycle': self.cycles,
+                'timestamp': int(self.started_at),
+                'duration': round(time.time() - self.started_at, 6),
+                'phases': dict(
+                    (phase, {'count': count, 'seconds': round(total, 6)})
+                    for phase, (count, total) in self.phases.iteritems()),
+                'counters': dict(self.counters)
+            }
+            record.update(extra)
+            for phase, (count, total) in self.phases.iteritems():
+                if phase not in self.history:
+                    self.history[phase] = deque(maxlen=self.window)
+                self.history[phase].append(total)
+            self._reset()
+        return record
+
+    def summary(self):
+        """
+        Median and 95th percentile of the time spent per cycle
+        in each phase over the window
+        """
+        with self.lock:
+            history = dict((phase, list(totals))
+                           for phase, totals in self.history.iteritems())
+        return dict((phase, {
+            'cycles': len(totals),
+            'p50': percentile(totals, 0.5),
+            'p95': percentile(totals, 0.95)
+        }) for phase, totals in history.iteritems())
+
+
+recorder = Recorder(app_config.INSTRUMENTATION_WINDOW)
+
+
+def timer(phase):
+    """
+    Context manager timing a phase
+    """
+    if not app_config.INSTRUMENTATION:
+        return _null_timer
+    return _Timer(recorder, phase)
+
+
+def timed(phase):
+    """
+    Decorator timing every call of a function as a phase
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not app_config.INSTRUMENTATION:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.add_time(phase, time.time() - start)
+        return wrapper
+    return decorator
+
+
+def incr(counter, n=1):
+    if app_config.INSTRUMENTATION:
+        recorder.incr(counter, n)
+
+
+def start_cycle():
+    """
+    Start timing a daemon cycle, dropping what was recorded before
+    """
+    if app_config.INSTRUMENTATION:
+        recorder.start_cycle()
+
+
+def end_cycle(**extra):
+    """
+    Write the timings of the daemon cycle that just ended to
+    INSTRUMENTATION_LOG_PATH and log the rolling summary every
+    INSTRUMENTATION_SUMMARY_CYCLES cycles
+    """
+    if not app_config.INSTRUMENTATION:
+        return None
+    record = recorder.end_cycle(**extra)
+    line = json.dumps(record, sort_keys=True)
+    if app_config.INSTRUMENTATION_LOG_PATH:
+        try:
+            with open(app_config.INSTRUMENTATION_LOG_PATH, 'a') as f:
+                f.write(line + '\n')
+        except IOError, e:
+            logger.warning('Could not write timings to %s: %s' % (
+                           app_config.INSTRUMENTATION_LOG_PATH, e))
+    else:
+        logger.info(line)
+    if record['cycle'] % app_config.INSTRUMENTATION_SUMMARY_CYCLES == 0:
+        log_summary()
+    return record
+
+
+def log_summary():
+    summary = recorder.summary()
+    for phase in sorted(summary):
+        stats = summary[phase]
+        logger.info('%s: p50 %.3fs, p95 %.3fs over %s cycles' % (
+                    phase, stats['p50'], stats['p95'], stats['cycles']))
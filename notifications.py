@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Notify live clients when a new version of the factcheck is published.
+
+The daemon writes the published version to a small json file once the
+factcheck has been deployed. Every app process runs a watcher thread
+that checks the file and wakes up the requests waiting for a change.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+def read_published_version(path=None):
+    """
+    Version and status last published, None if nothing was published
+    """
+    if not path:
+        path = app_config.PUBLISHED_VERSION_PATH
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def publish_version(version, status, path=None):
+    """
+    Record that version was deployed, returning False if it
+    already was the published version
+    """
+    if not path:
+        path = app_config.PUBLISHED_VERSION_PATH
+    published = read_published_version(path)
+    if published and published['version'] == version:
+        return False
+    payload = {
+        'version': version,
+        'status': status,
+        'timestamp': int(time.time())
+    }
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.rename(tmp_path, path)
+    logger.info('Published version %s' % version)
+    return True
+
+
+class VersionWatcher(object):
+    """
+    Watch the published version file and wake up waiting requests
+    """
+    def __init__(self, path=None, interval=1):
+        self.path = path or app_config.PUBLISHED_VERSION_PATH
+        self.interval = interval
+        self.published = read_published_version(self.path)
+        self.stat = self._stat()
+        self.condition = threading.Condition()
+        self.waiting = 0
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    @property
+    def version(self):
+        return self.published['version'] if self.published else None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+    def start(self):
+        """
+        Start the watcher thread of this process if it is not running
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run,
+                                           name='version-watcher')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception, e:
+                logger.error('Version watcher failed: %s' % e)
+
+    def check(self):
+        """
+        Reload the published version if the file changed
+        """
+        stat = self._stat()
+        if stat == self.stat:
+            return
+        self.stat = stat
+        published = read_published_version(self.path)
+        if published is None or published == self.published:
+            return
+        with self.condition:
+            self.published = published
+            self.condition.notify_all()
+
+    def wait(self, since, timeout):
+        """
+        Wait until the published version differs from since
+        or timeout seconds have passed, returning the published data
+        """
+        self.start()
+        deadline = time.time() + timeout
+        with self.condition:
+            self.waiting += 1
+            try:
+                while self.version == since:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            return self.published
@@ -1,6 +1,9 @@
 import app_config
 import codecs
+import logging
 import os
+import threading
+import time
 
 from app_config import authomatic
 from authomatic.adapters import WerkzeugAdapter
@@ -14,6 +17,10 @@ from render_utils import make_context
 DRIVE_API_EXPORT_TEMPLATE = 'https://www.googleapis.com/drive/v3/files/%s/export?mimeType=%s'
 DOC_URL_TEMPLATE = 'https://www.googleapis.com/drive/v3/files/%s/export?mimeType=text/html'
 
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
 oauth = Blueprint('_oauth', __name__)
 
 @oauth.route('/oauth/')
@@ -72,11 +79,80 @@ def oauth_required(f):
             return redirect(url_for('_oauth.oauth_alert'))
         else:
             if request.args.get('refresh'):
-                get_doc(app_config.TRANSCRIPT_GDOC_KEY,
-                        app_config.TRANSCRIPT_HTML_PATH)
+                status = refresh_doc(app_config.TRANSCRIPT_GDOC_KEY,
+                                     app_config.TRANSCRIPT_HTML_PATH)
+                response = make_response(f(*args, **kwargs))
+                response.headers['X-Refresh-Status'] = status
+                return response
             return f(*args, **kwargs)
     return decorated_function
 
+
+class DocRefresher(object):
+    """
+    Download a google doc in a background thread. Only one download
+    runs at a time and a new one starts at most every min_interval
+    seconds, so simultaneous refreshes share a single download.
+    """
+    def __init__(self, key, file_path, min_interval=0, fetch=None):
+        self.key = key
+        self.file_path = file_path
+        self.min_interval = min_interval
+        self.fetch = fetch or get_doc
+        self.lock = threading.Lock()
+        self.running = False
+        self.started = 0
+        self.error = None
+
+    def refresh(self):
+        """
+        Start a download if none is running and the previous one started
+        long enough ago, returning started, running or throttled
+        """
+        with self.lock:
+            if self.running:
+                return 'running'
+            if time.time() - self.started < self.min_interval:
+                return 'throttled'
+            self.running = True
+            self.started = time.time()
+        thread = threading.Thread(target=self._fetch)
+        thread.daemon = True
+        thread.start()
+        return 'started'
+
+    def _fetch(self):
+        try:
+            self.fetch(self.key, self.file_path)
+            self.error = None
+        except Exception, e:
+            logger.error('Could not refresh %s: %s' % (self.key, e))
+            self.error = str(e)
+        finally:
+            with self.lock:
+                self.running = False
+
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def refresh_doc(key, file_path):
+    """
+    Refresh the google doc in the background, returning the status
+    of the refresh. The last download error is reported along with it
+    """
+    with _refreshers_lock:
+        refresher = _refreshers.get((key, file_path))
+        if refresher is None:
+            refresher = DocRefresher(key, file_path,
+                                     app_config.REFRESH_MIN_INTERVAL)
+            _refreshers[(key, file_path)] = refresher
+    status = refresher.refresh()
+    if refresher.error and status != 'started':
+        status = '%s; last refresh failed' % status
+    return status
+
 def get_credentials():
     """
     Read Authomatic credentials object from disk and refresh if necessary.
@@ -143,8 +219,11 @@ def get_doc(key, file_path):
         else:
             raise KeyError("Error! Google returned a %s error" % response.status)
 
-    with codecs.open(file_path, 'w', 'utf-8') as writefile:
+    # Replace the file atomically so readers never see a partial doc
+    tmp_path = '%s.%s.tmp' % (file_path, os.getpid())
+    with codecs.open(tmp_path, 'w', 'utf-8') as writefile:
         writefile.write(response.content)
+    os.rename(tmp_path, file_path)
 
 def _has_api_credentials():
     """
@@ -1,12 +1,25 @@
 #!/usr/bin/env python
 # _*_ coding:utf-8 _*_
+import codecs
+import hashlib
 import logging
+import multiprocessing
+import os
 import re
+import threading
 import app_config
 import xlrd
+from bs4 import BeautifulSoup, NavigableString
+from collections import OrderedDict
+from copydoc import CopyDoc
+from fragment_cache import FragmentCache
+from HTMLParser import HTMLParser
 from jinja2 import Environment, FileSystemLoader
 
 env = Environment(loader=FileSystemLoader('templates/transcript'))
+fragment_cache = FragmentCache(env,
+                               max_size=app_config.FRAGMENT_CACHE_SIZE,
+                               path=app_config.FRAGMENT_CACHE_PATH)
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
@@ -38,9 +51,35 @@ extract_speaker_metadata_regex = re.compile(
     ur'^\s*(<.*?>)?([A-Z0-9\s\.,-]+)\s*(?:\[(.*)\]\s*)?:\s*(.*)', re.UNICODE)
 extract_soundbite_metadata_regex = re.compile(
     ur'^\s*(?:<.*?>)?\s*:\[\((.*)\)\]', re.UNICODE)
+# Classifies and extracts transcript paragraph fields in a single scan
+# of its markup. Speaker names use the speaker_regex character class,
+# the whitespace before the colon is stripped afterwards: matching it
+# with its own \s* would backtrack quadratically on long whitespace runs.
+paragraph_regex = re.compile(
+    ur'^(?P<open>(?:<[^>]*>)*)(?:'
+    ur'(?P<speaker>[A-Z\s\.,-]+?)(?:\[(?P<timestamp>.*)\]\s*)?:'
+    ur'\s*(?P<text>.*)'
+    ur'|\s*:(?:\[\((?P<soundbite>.*)\)\])?)', re.UNICODE)
 extract_author_metadata_regex = re.compile(
     ur'^.*\((.+)\)\s*$', re.UNICODE)
 
+# Elements that never have an end tag
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img',
+                           'input', 'link', 'meta', 'param', 'source',
+                           'track', 'wbr'])
+HR_MARKER = object()
+
+# Authors dictionary and the stat of the excel file it was read from
+_authors_cache = {
+    'stat': None,
+    'authors': {}
+}
+_authors_lock = threading.Lock()
+
+
+# Authors dictionary of the parallel parse worker processes
+_worker_authors = None
+
 
 def is_anno_start_marker(tag):
     """
@@ -80,8 +119,8 @@ def transform_transcript_markup(transcript):
     """
     Transform factcheck markup to final format
     """
-    template = env.get_template('%s.html' % transcript['type'])
-    transcript_markup = template.render(**transcript['context'])
+    transcript_markup = fragment_cache.render('%s.html' % transcript['type'],
+                                              transcript['context'])
     markup = replace_strong_tags(transcript_markup)
     return markup
 
@@ -90,11 +129,171 @@ def transform_annotation_markup(context):
     """
     Transform factcheck markup to final format
     """
-    template = env.get_template('annotation.html')
-    annotation_markup = template.render(**context)
+    annotation_markup = fragment_cache.render('annotation.html', context)
     return annotation_markup
 
 
+class Record(object):
+    """
+    Base class for parsed transcript contents.
+
+    Records only store the fields their template needs, the markup is
+    rendered through the fragment cache on first access and kept on the
+    record, it is not pickled. Fields can also be read as items so records
+    can be used wherever the old dicts were.
+    """
+    __slots__ = ('_markup',)
+    fields = ()
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.iteritems():
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def context(self):
+        """
+        Template context of the record
+        """
+        return dict([(k, getattr(self, k)) for k in self.fields
+                     if hasattr(self, k)])
+
+    @property
+    def markup(self):
+        try:
+            return self._markup
+        except AttributeError:
+            markup = self._markup = self.render_markup()
+            return markup
+
+    def as_dict(self):
+        """
+        Dict with the shape parse used to return for this record
+        """
+        return {'type': self.type,
+                'context': self.context,
+                'markup': self.markup,
+                'published': self.published}
+
+    def __getstate__(self):
+        return self.context
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and
+                self.__getstate__() == other.__getstate__())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.__getstate__())
+
+
+class TranscriptRecord(Record):
+    """
+    Transcript paragraphs are always published
+    """
+    __slots__ = ()
+    published = 'yes'
+
+    def render_markup(self):
+        return transform_transcript_markup(self)
+
+
+class SpeakerRecord(TranscriptRecord):
+    fields = ('speaker_class', 'speaker', 'timestamp', 'transcript_text')
+    __slots__ = fields
+    type = 'speaker'
+
+
+class SoundbiteRecord(TranscriptRecord):
+    fields = ('soundbite',)
+    __slots__ = fields
+    type = 'soundbite'
+
+
+class OtherRecord(TranscriptRecord):
+    fields = ('text', 'checked')
+    __slots__ = fields
+    type = 'other'
+
+
+TRANSCRIPT_RECORDS = {
+    'speaker': SpeakerRecord,
+    'soundbite': SoundbiteRecord,
+    'other': OtherRecord
+}
+
+
+class AnnotationRecord(Record):
+    """
+    Annotation with its frontmatter metadata, keys other than
+    the known ones are kept on the metadata dict
+    """
+    fields = ('slug', 'published', 'author', 'role', 'page', 'image',
+              'prior', 'contents')
+    __slots__ = fields + ('metadata',)
+    type = 'annotation'
+
+    def __init__(self, metadata, contents):
+        self.metadata = {}
+        for k, v in metadata.iteritems():
+            if k in self.fields:
+                setattr(self, k, v)
+            else:
+                self.metadata[k] = v
+        self.contents = contents
+
+    def __getitem__(self, key):
+        try:
+            return Record.__getitem__(self, key)
+        except KeyError:
+            return self.metadata[key]
+
+    @property
+    def context(self):
+        context = dict(self.metadata)
+        context.update(Record.context.fget(self))
+        return context
+
+    def render_markup(self):
+        return transform_annotation_markup(self.context)
+
+    def as_dict(self):
+        annotation = self.context
+        annotation['markup'] = self.markup
+        annotation['type'] = self.type
+        return annotation
+
+    def __getstate__(self):
+        return self.context
+
+    def __setstate__(self, state):
+        self.__init__(state, state.pop('contents'))
+
+
 def process_speaker_transcript(contents):
     """
     parses speaker paragraphs.
@@ -210,75 +409,251 @@ def process_annotation_contents(contents):
     return post_contents
 
 
+def classify_paragraph(contents):
+    """
+    Single pass replacement for the speaker, soundbite and other cascade.
+    Returns the paragraph type and the context for its template
+    """
+    m = paragraph_regex.match(contents)
+    if m:
+        if m.group('speaker') is not None:
+            speaker = m.group('speaker').strip()
+            try:
+                speaker_class = app_config.SPEAKERS[speaker]
+            except KeyError:
+                logger.debug('did not find speaker: %s' % speaker)
+                speaker_class = 'speaker'
+            context = {'speaker_class': speaker_class,
+                       'speaker': speaker,
+                       'timestamp': m.group('timestamp'),
+                       'transcript_text': m.group('open') + m.group('text')}
+            return 'speaker', context
+        if m.group('soundbite') is not None:
+            context = {'soundbite': '(%s)' % m.group('soundbite')}
+            return 'soundbite', context
+        logger.error("ERROR: Unexpected metadata format %s" % contents)
+    return 'other', process_other_transcript(contents)
+
+
 def process_transcript_content(tag):
     """
-    TODO
+    Classifies a transcript paragraph and extracts its metadata
     """
-    text = tag.get_text()
-    combined_contents = unicode(tag)
-    # for content in tag.contents:
-    #     combined_contents += unicode(content)
-    if speaker_regex.match(text):
-        typ = 'speaker'
-        context = process_speaker_transcript(combined_contents)
-    elif soundbite_regex.match(text):
-        typ = 'soundbite'
-        context = process_soundbite_transcript(combined_contents)
+    return classify_paragraph(unicode(tag))
+
+
+def process_annotation(contents, authors):
+    """
+    Divide an annotation into its subparts
+    - FrontMatter
+    - Contents
+    """
+    marker_counter = 0
+    raw_metadata = []
+    raw_contents = []
+    for tag in contents:
+        text = tag.get_text()
+        m = frontmatter_marker_regex.match(text)
+        if m:
+            marker_counter += 1
+        else:
+            if not marker_counter:
+                continue
+            if (marker_counter == 1):
+                raw_metadata.append(tag)
+            else:
+                raw_contents.append(tag)
+    metadata = process_metadata(raw_metadata)
+    add_author_metadata(metadata, authors)
+    contents = process_annotation_contents(raw_contents)
+    return AnnotationRecord(metadata, contents)
+
+
+def process_transcript(tag):
+    """
+    Parse a transcript paragraph into its record
+    """
+    return process_transcript_markup(unicode(tag))
+
+
+def process_transcript_markup(contents):
+    """
+    Parse the markup of a transcript paragraph into its record
+    """
+    typ, context = classify_paragraph(contents)
+    return TRANSCRIPT_RECORDS[typ](**context)
+
+
+def process_record(r, authors):
+    """
+    Parse a categorized record into a transcript or annotation object
+    """
+    if r['type'] == 'annotation':
+        return process_annotation(r['contents'], authors)
     else:
-        typ = 'other'
-        context = process_other_transcript(combined_contents)
-    return typ, context
+        return process_transcript(r['content'])
 
 
-def parse_raw_contents(data, status, authors):
+def serialize_record(r):
+    """
+    Markup of a categorized record, independent of the document tree
+    """
+    if r['type'] == 'annotation':
+        return r['type'], tuple([unicode(tag) for tag in r['contents']])
+    else:
+        return r['type'], unicode(r['content'])
+
+
+def process_serialized_record(serialized, authors):
+    """
+    Parse a serialized record into a transcript or annotation object
+    """
+    typ, markup = serialized
+    if typ == 'annotation':
+        tags = []
+        for contents in markup:
+            tags.extend(BeautifulSoup(contents, 'html.parser').contents)
+        return process_annotation(tags, authors)
+    else:
+        return process_transcript_markup(markup)
+
+
+def hash_serialized_record(serialized):
+    typ, markup = serialized
+    if typ == 'annotation':
+        markup = u''.join(markup)
+    key = u'%s:%s' % (typ, markup)
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def hash_record(r):
+    """
+    Computes a content hash for a categorized record
+    used to detect unchanged records between parses
+    """
+    return hash_serialized_record(serialize_record(r))
+
+
+def _init_parse_worker(authors):
+    global _worker_authors
+    _worker_authors = authors
+
+
+def _process_serialized_chunk(chunk):
+    return [process_serialized_record(serialized, _worker_authors)
+            for serialized in chunk]
+
+
+def process_records_parallel(records, authors, processes):
+    """
+    Process serialized records on a pool of processes.
+    Results are returned in the same order as records
+    """
+    # A few chunks per process to even out the load
+    size = max(1, len(records) / (processes * 4) + 1)
+    chunks = [records[i:i + size] for i in xrange(0, len(records), size)]
+    pool = multiprocessing.Pool(processes, _init_parse_worker, (authors,))
+    try:
+        results = pool.map(_process_serialized_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return [parsed for chunk in results for parsed in chunk]
+
+
+class IncrementalCache(object):
+    """
+    Parsed records of the last incremental parse of a document keyed by
+    content hash, with the authors they were parsed with
+    """
+    def __init__(self):
+        self.authors = None
+        self.records = {}
+        self.lock = threading.Lock()
+
+
+def parse_raw_contents(data, status, authors, incremental=None,
+                       parallel=None):
     """
     parse raw contents into an array of parsed transcript & annotation objects
+
+    If incremental is an IncrementalCache, records whose content hash was
+    already seen on its previous parse are reused instead of being processed
+    again. Parses sharing the cache run one at a time.
+
+    If parallel is set records are processed on a pool of processes, by
+    default only documents with at least PARALLEL_PARSE_THRESHOLD records
+    on machines with more than one cpu, and never from the threads of
+    the app, which must not fork.
     """
+    processes = (app_config.PARALLEL_PARSE_PROCESSES or
+                 multiprocessing.cpu_count())
+    if parallel is None:
+        threshold = app_config.PARALLEL_PARSE_THRESHOLD
+        parallel = (threshold and processes > 1 and
+                    isinstance(threading.current_thread(),
+                               threading._MainThread) and
+                    isinstance(data, list) and len(data) >= threshold)
+    if incremental is None:
+        return _parse_raw_contents(data, status, authors, None, parallel,
+                                   processes)
+    with incremental.lock:
+        return _parse_raw_contents(data, status, authors, incremental,
+                                   parallel, processes)
+
 
-    # Divide each annotation into its subparts
-    # - FrontMatter
-    # - Contents
-    # Parse rest of doc content, i.e., transcript contents
+def _parse_raw_contents(data, status, authors, incremental, parallel,
+                        processes):
     contents = []
+    if incremental:
+        # Author changes affect every annotation, start from scratch
+        if authors != incremental.authors:
+            incremental.records = {}
+        previous = incremental.records
+        current = {}
+    reused = 0
+    pending = []
+    for r in data:
+        parsed = None
+        if parallel:
+            serialized = serialize_record(r)
+        if incremental:
+            if parallel:
+                key = hash_serialized_record(serialized)
+            else:
+                key = hash_record(r)
+            parsed = current.get(key) or previous.get(key)
+            if parsed is not None:
+                reused += 1
+                current[key] = parsed
+        if parsed is None:
+            if parallel:
+                # Processed later on, keep the position in the document
+                pending.append((len(contents), serialized))
+            else:
+                parsed = process_record(r, authors)
+                if incremental:
+                    current[key] = parsed
+        contents.append(parsed)
+    if pending:
+        logger.info('Processing %s records in parallel' % len(pending))
+        results = process_records_parallel(
+            [serialized for i, serialized in pending], authors, processes)
+        for (i, serialized), parsed in zip(pending, results):
+            contents[i] = parsed
+            if incremental:
+                current[hash_serialized_record(serialized)] = parsed
     if not status:
-        if len(data):
+        if len(contents):
             status = 'during'
         else:
             status = 'before'
-    for r in data:
-        if r['type'] == 'annotation':
-            annotation = {}
-            marker_counter = 0
-            raw_metadata = []
-            raw_contents = []
-            for tag in r['contents']:
-                text = tag.get_text()
-                m = frontmatter_marker_regex.match(text)
-                if m:
-                    marker_counter += 1
-                else:
-                    if not marker_counter:
-                        continue
-                    if (marker_counter == 1):
-                        raw_metadata.append(tag)
-                    else:
-                        raw_contents.append(tag)
-            metadata = process_metadata(raw_metadata)
-            add_author_metadata(metadata, authors)
-            for k, v in metadata.iteritems():
-                annotation[k] = v
-            annotation[u'contents'] = process_annotation_contents(raw_contents)
-            annotation[u'markup'] = transform_annotation_markup(annotation)
-            annotation[u'type'] = "annotation"
-            contents.append(annotation)
-        else:
-            transcript = {'type': 'other'}
-            typ, context = process_transcript_content(r['content'])
-            transcript['type'] = typ
-            transcript['context'] = context
-            transcript['markup'] = transform_transcript_markup(transcript)
-            transcript['published'] = 'yes'
-            contents.append(transcript)
+    if incremental:
+        # Only keep records present on the latest version of the document
+        incremental.authors = authors
+        incremental.records = current
+        logger.info('Incremental parse: reused %s, processed %s' % (
+                    reused, len(contents) - reused))
     return contents, status
 
 
@@ -321,26 +696,236 @@ def categorize_doc_content(doc):
                     break
             hr.unwrap()
 
-    result = []
     body = doc.soup.body
+    result = list(categorize_children(body.children))
+    return result, fact_check_status
+
+
+def categorize_children(children):
+    """
+    Bundles together the annotations found between start and end markers
+    yielding transcript and annotation records in document order
+    """
     inside_annotation = False
     annotation_contents = []
-    for child in body.children:
+    for child in children:
         logger.debug("child: %s" % child)
         if is_anno_start_marker(child):
             inside_annotation = True
             annotation_contents = []
         elif is_anno_end_marker(child):
             inside_annotation = False
-            result.append({'type': 'annotation',
-                           'contents': annotation_contents})
+            yield {'type': 'annotation',
+                   'contents': annotation_contents}
         else:
             if inside_annotation:
                 annotation_contents.append(child)
             else:
-                result.append({'type': 'transcript',
-                               'content': child})
-    return result, fact_check_status
+                yield {'type': 'transcript',
+                       'content': child}
+
+
+class BodySplitter(HTMLParser):
+    """
+    Event based parser that splits the body of an html document
+    into the markup of its top level elements.
+
+    Top level horizontal rules are reported as HR_MARKER.
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.in_body = False
+        self.depth = 0
+        self.buffer = []
+        self.chunks = []
+
+    def pop_chunks(self):
+        chunks = self.chunks
+        self.chunks = []
+        return chunks
+
+    def _flush(self):
+        self.chunks.append(u''.join(self.buffer))
+        self.buffer = []
+
+    def _append(self, markup):
+        self.buffer.append(markup)
+        if not self.depth:
+            self._flush()
+
+    def handle_starttag(self, tag, attrs):
+        if not self.in_body:
+            self.in_body = (tag == 'body')
+            return
+        if tag == 'hr' and not self.depth:
+            self.chunks.append(HR_MARKER)
+            return
+        if tag in VOID_ELEMENTS:
+            self._append(self.get_starttag_text())
+        else:
+            self.buffer.append(self.get_starttag_text())
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.in_body:
+            return
+        if tag == 'hr' and not self.depth:
+            self.chunks.append(HR_MARKER)
+            return
+        self._append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if not self.in_body or tag in VOID_ELEMENTS:
+            return
+        if not self.depth:
+            if tag == 'body':
+                self.in_body = False
+            return
+        self.depth -= 1
+        self._append(u'</%s>' % tag)
+
+    def handle_data(self, data):
+        if not self.in_body:
+            return
+        if self.depth:
+            self.buffer.append(data)
+        elif data.strip():
+            self._append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        self.handle_data(u'&#%s;' % name)
+
+
+def clean_fragment(markup):
+    """
+    Cleans the markup of a top level element the same way CopyDoc
+    cleans the whole document
+    """
+    doc = CopyDoc(u'<html><body>%s</body></html>' % markup)
+    return [child for child in doc.soup.body.children
+            if not isinstance(child, NavigableString)]
+
+
+def find_paragraph(tags, regex):
+    """
+    Equivalent of soup.find('p', text=regex) over a list of tags
+    """
+    for tag in tags:
+        if tag.name == 'p' and tag.string and regex.search(tag.string):
+            return tag
+        if tag.find('p', text=regex):
+            return tag
+    return None
+
+
+class StreamingCategorizer(object):
+    """
+    Alternative to categorize_doc_content that reads the google doc html
+    export incrementally instead of building the whole document tree.
+
+    Iterating yields the same transcript and annotation records
+    as categorize_doc_content, one at a time. Since the end of document
+    marker comes last, the status is only known once iteration is over.
+    Only the first top level horizontal rule is taken into account.
+    """
+    def __init__(self, source, chunk_size=16384):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.status = None
+
+    def __iter__(self):
+        return categorize_children(self.children())
+
+    def read(self):
+        """
+        Yields unicode pieces of the source, a file object or a string
+        """
+        if hasattr(self.source, 'read'):
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            while True:
+                data = self.source.read(self.chunk_size)
+                if not data:
+                    break
+                if isinstance(data, unicode):
+                    yield data
+                else:
+                    yield decoder.decode(data)
+            yield decoder.decode('', final=True)
+        else:
+            html = self.source
+            if not isinstance(html, unicode):
+                html = html.decode('utf-8', 'replace')
+            for i in xrange(0, len(html), self.chunk_size):
+                yield html[i:i + self.chunk_size]
+
+    def children(self):
+        """
+        Yields the cleaned top level elements of the document body
+        """
+        self.status = None
+        splitter = BodySplitter()
+        tail = None
+        pieces = self.read()
+        while True:
+            try:
+                splitter.feed(next(pieces))
+            except StopIteration:
+                splitter.close()
+                pieces = None
+            # Clean the elements read so far in one go, building a soup
+            # per element is far more expensive
+            batch = []
+            for markup in splitter.pop_chunks() + [None]:
+                if markup is not None and markup is not HR_MARKER:
+                    batch.append(markup)
+                    continue
+                for tag in clean_fragment(u''.join(batch)):
+                    if tail is None:
+                        yield tag
+                    else:
+                        tail.append(tag)
+                batch = []
+                if markup is HR_MARKER and tail is None:
+                    tail = []
+            if pieces is None:
+                break
+        if tail is not None:
+            for tag in self.process_tail(tail):
+                yield tag
+
+    def process_tail(self, tail):
+        """
+        Applies the end of document rules of categorize_doc_content
+        to the elements found after the horizontal rule
+        """
+        kept = []
+        for tag in tail:
+            if tag.name == 'div':
+                continue
+            for comment in tag.find_all('div'):
+                comment.decompose()
+            kept.append(tag)
+        if find_paragraph(kept, end_fact_check_regex):
+            self.status = 'after'
+            return []
+        if find_paragraph(kept, end_transcript_regex):
+            self.status = 'transcript-end'
+            return []
+        for child in kept:
+            if (child.string):
+                after_hr_text = child.string
+            else:
+                after_hr_text = child.get_text()
+            m = do_not_write_regex.match(after_hr_text)
+            if m:
+                kept.remove(child)
+                if m.group(1):
+                    self.status = 'error'
+                break
+        return kept
 
 
 def getAuthorsData():
@@ -383,21 +968,68 @@ def getAuthorsData():
         return authors
 
 
-def parse(doc, authors=None):
+def get_authors():
+    """
+    Returns the authors dictionary, the excel file is only read again
+    when it has changed on disk since the last time it was read
+    """
+    try:
+        st = os.stat(app_config.AUTHORS_PATH)
+    except OSError:
+        return getAuthorsData()
+    stat = (app_config.AUTHORS_PATH, st.st_mtime, st.st_size)
+    with _authors_lock:
+        if stat != _authors_cache['stat']:
+            logger.info('Loading authors from %s' % app_config.AUTHORS_PATH)
+            _authors_cache['authors'] = getAuthorsData()
+            _authors_cache['stat'] = stat
+        return _authors_cache['authors']
+
+
+def build_embeds_index(contents):
+    """
+    Map the slug of each published annotation to its position in
+    contents and its record, in document order. If a slug is repeated
+    the first annotation wins
+    """
+    embeds = OrderedDict()
+    for position, record in enumerate(contents):
+        if (record['type'] != 'annotation' or
+                record.get('published') != 'yes'):
+            continue
+        slug = record.get('slug')
+        if slug and slug not in embeds:
+            embeds[slug] = (position, record)
+    return embeds
+
+
+def parse(doc, authors=None, incremental=None):
     """
     Custom parser for the debates google doc format
+
+    doc is either a CopyDoc or a StreamingCategorizer
+
+    Pass the IncrementalCache of the document as incremental to reprocess
+    only the records that changed since its previous parse
     """
     context = {}
     logger.info('-------------start------------')
     if not authors:
-        authors = getAuthorsData()
+        authors = get_authors()
     # Categorize content of original doc into transcript and annotations
-    raw_contents, status = categorize_doc_content(doc)
-    contents, status = parse_raw_contents(raw_contents, status, authors)
-    number_of_fact_checks = len([x for x in raw_contents
+    if isinstance(doc, StreamingCategorizer):
+        # Records are consumed as they are categorized
+        contents, status = parse_raw_contents(doc, None, authors,
+                                              incremental)
+        if doc.status:
+            status = doc.status
+    else:
+        raw_contents, status = categorize_doc_content(doc)
+        contents, status = parse_raw_contents(raw_contents, status, authors,
+                                              incremental)
+    number_of_fact_checks = len([x for x in contents
                                 if x['type'] == 'annotation'])
-    number_of_transcript = len([x for x in raw_contents
-                                if x['type'] == 'transcript'])
+    number_of_transcript = len(contents) - number_of_fact_checks
     logger.info('Fact Checks: %s, Transcript Paragraphs: %s' % (
                 number_of_fact_checks,
                 number_of_transcript))
@@ -405,5 +1037,6 @@ def parse(doc, authors=None):
 
     context['contents'] = contents
     context['status'] = status
+    context['embeds'] = build_embeds_index(contents)
     logger.info('-------------end------------')
     return context
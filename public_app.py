@@ -4,9 +4,11 @@ import app_config
 import datetime
 import json
 import logging
+import notifications
 import static
+import time
 
-from flask import Flask, make_response, render_template
+from flask import Flask, Response, abort, make_response, render_template, request
 from render_utils import make_context, smarty_filter, urlencode_filter
 from werkzeug.debug import DebuggedApplication
 
@@ -31,6 +33,9 @@ app.register_blueprint(static.static, url_prefix='/%s' % app_config.PROJECT_SLUG
 app.add_template_filter(smarty_filter, name='smarty')
 app.add_template_filter(urlencode_filter, name='urlencode')
 
+version_watcher = notifications.VersionWatcher(
+    interval=app_config.NOTIFICATION_CHECK_INTERVAL)
+
 # Example application views
 @app.route('/%s/test/' % app_config.PROJECT_SLUG, methods=['GET'])
 def _test_app():
@@ -54,6 +59,54 @@ def index():
 
     return make_response(render_template('index.html', **context))
 
+@app.route('/%s/live/version.json' % app_config.PROJECT_SLUG, methods=['GET'])
+def _live_version():
+    """
+    Long poll: answer as soon as the published version differs from
+    the since argument, or with the same version after a timeout
+    """
+    if not app_config.LIVE_NOTIFICATIONS:
+        abort(404)
+    since = request.args.get('since')
+    published = version_watcher.wait(since, app_config.LONG_POLL_TIMEOUT)
+    response = make_response(json.dumps(published or {'version': None}))
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _event(published):
+    return 'id: %s\nevent: version\ndata: %s\n\n' % (
+        published['version'], json.dumps(published))
+
+
+@app.route('/%s/live/events' % app_config.PROJECT_SLUG, methods=['GET'])
+def _live_events():
+    """
+    Server-Sent Events stream of the published versions. The stream is
+    closed after a while and the browser reconnects with Last-Event-ID
+    """
+    if not app_config.LIVE_NOTIFICATIONS:
+        abort(404)
+    since = request.headers.get('Last-Event-ID', request.args.get('since'))
+
+    def stream(since):
+        yield 'retry: %i\n\n' % (app_config.NOTIFICATION_RETRY * 1000)
+        end = time.time() + app_config.EVENT_STREAM_DURATION
+        while time.time() < end:
+            published = version_watcher.wait(
+                since, app_config.EVENT_STREAM_HEARTBEAT)
+            if published and published['version'] != since:
+                since = published['version']
+                yield _event(published)
+            else:
+                yield ': keepalive\n\n'
+
+    response = Response(stream(since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # Enable Werkzeug debug pages
 if app_config.DEBUG:
     wsgi_app = DebuggedApplication(app, evalex=False)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Pages of a parsed transcript rendered straight from the templates.
+
+The factcheck, preview, share, embed list and embed pages only depend
+on the parsed document and the configuration, so they are rendered
+without a request context: the templates are loaded once and the
+context shared by every page is built once per document version.
+"""
+import logging
+
+import app_config
+from render_utils import get_app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+class RenderEngine(object):
+    """
+    Render the transcript pages with the templates of a jinja environment
+    """
+    def __init__(self, env):
+        self.env = env
+        self.templates = {}
+        # (parsed document, live version, config, context)
+        self._context = (None, None, None, None)
+
+    def template(self, name):
+        """
+        Template loaded once, or again if it changed on disk
+        when the environment reloads templates
+        """
+        template = self.templates.get(name)
+        if template is None or (self.env.auto_reload and
+                                not template.is_up_to_date):
+            template = self.env.get_template(name)
+            self.templates[name] = template
+        return template
+
+    def context(self, parsed_document, live_version):
+        """
+        Context shared by every page of a document version, must not
+        be modified by the caller
+        """
+        config = get_app_config()
+        document, version, context_config, context = self._context
+        if (document is parsed_document and version == live_version and
+                context_config is config):
+            return context
+        context = dict(config)
+        context['config'] = config
+        context.update(parsed_document)
+        context['live_version'] = live_version
+        self._context = (parsed_document, live_version, config, context)
+        return context
+
+    def render(self, template_name, context, **extra):
+        if extra:
+            context = dict(context, **extra)
+        return self.template(template_name).render(context)
+
+    def generate(self, template_name, context, **extra):
+        """
+        Rendered template as a generator of unicode chunks
+        """
+        if extra:
+            context = dict(context, **extra)
+        return self.template(template_name).generate(context)
+
+    def _factcheck_extra(self, preview, contents):
+        extra = {'preview': preview}
+        if contents is not None:
+            extra['contents'] = contents
+        return extra
+
+    def factcheck(self, context, preview=False, contents=None):
+        """
+        Published posts, or every post on the preview. contents
+        replaces the posts of the document
+        """
+        return self.render('factcheck.html', context,
+                           **self._factcheck_extra(preview, contents))
+
+    def generate_factcheck(self, context, preview=False, contents=None):
+        return self.generate('factcheck.html', context,
+                             **self._factcheck_extra(preview, contents))
+
+    def share(self, context):
+        return self.render('share.html', context)
+
+    def embedlist(self, context):
+        return self.render('embedlist.html', context,
+                           slugs=context['embeds'].keys())
+
+    def embed(self, context, slug):
+        """
+        Embed of the annotation published as slug, None if there is none
+        """
+        try:
+            index, annotation = context['embeds'][slug]
+        except KeyError:
+            return None
+        return self.render('embed.html', context, slug=slug,
+                           filtered=annotation,
+                           prior=get_embed_prior(context['contents'],
+                                                 index, annotation))
+
+    def page(self, endpoint, context):
+        """
+        Page of the factcheck view endpoint
+        """
+        if endpoint == '_share':
+            return self.share(context)
+        return self.factcheck(context, preview=(endpoint == '_preview'))
+
+
+def get_embed_prior(contents, index, annotation):
+    """
+    Paragraphs shown before an annotation in its embed
+    """
+    paragraphs = int(annotation.get('prior', 1))
+    start = index - paragraphs
+    return contents[start:index]
@@ -1,19 +1,24 @@
 #!/usr/bin/env python
 
-import codecs
 from datetime import datetime
+import hashlib
 import json
 import logging
+import os
+import threading
 import time
 import urllib
 import subprocess
+from collections import MutableMapping
 
 from flask import Markup, g, render_template, request
 from slimit import minify
 from smartypants import smartypants
 
 import app_config
+import artifacts
 import copytext
+import instrumentation
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
@@ -31,6 +36,121 @@ class BetterJSONEncoder(json.JSONEncoder):
 
         return encoded_object
 
+_compile_locks = {}
+_compile_locks_lock = threading.Lock()
+
+_tool_versions = {}
+
+def _tool_version(name):
+    """
+    Version of slimit or lessc, part of the compression cache keys.
+    """
+    try:
+        return _tool_versions[name]
+    except KeyError:
+        pass
+
+    version = None
+
+    try:
+        if name == 'slimit':
+            import pkg_resources
+            version = pkg_resources.get_distribution('slimit').version
+        else:
+            with open('node_modules/less/package.json') as f:
+                version = json.load(f)['version']
+    except Exception:
+        logger.warning('Could not determine the version of %s' % name)
+
+    return _tool_versions.setdefault(name, version)
+
+def _less_hash():
+    """
+    Hash of every LESS file, any of them may be imported by a stylesheet.
+    """
+    h = hashlib.sha1()
+
+    for root, dirs, files in os.walk('less'):
+        dirs.sort()
+
+        for name in sorted(files):
+            path = os.path.join(root, name)
+
+            h.update(path)
+            h.update(artifacts.file_hash(path) or '')
+
+    return h.hexdigest()
+
+def cached_compression(key, compress):
+    """
+    Compressed source stored under key in COMPRESSION_CACHE_PATH,
+    calling compress to produce it on a miss.
+    """
+    cache_path = app_config.COMPRESSION_CACHE_PATH
+
+    if not cache_path:
+        return compress()
+
+    path = os.path.join(cache_path, key)
+
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        instrumentation.incr('compression_cache_hits')
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+    except IOError:
+        pass
+
+    data = compress()
+    instrumentation.incr('compression_cache_misses')
+
+    if not os.path.exists(cache_path):
+        try:
+            os.makedirs(cache_path)
+        except OSError:
+            pass
+
+    tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(),
+                                 threading.current_thread().ident)
+
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+
+    os.rename(tmp_path, path)
+
+    _prune_compression_cache(cache_path)
+
+    return data
+
+def _prune_compression_cache(cache_path):
+    """
+    Remove the least recently used entries beyond COMPRESSION_CACHE_SIZE.
+    """
+    entries = []
+
+    for name in os.listdir(cache_path):
+        if name.endswith('.tmp'):
+            continue
+
+        path = os.path.join(cache_path, name)
+
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+
+    entries.sort()
+
+    for mtime, path in entries[:-app_config.COMPRESSION_CACHE_SIZE or None]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 class Includer(object):
     """
     Base class for Javascript and CSS psuedo-template-tags.
@@ -65,22 +185,28 @@ class Includer(object):
 
     def render(self, path):
         if getattr(g, 'compile_includes', False):
-            if path in g.compiled_includes:
-                timestamp_path = g.compiled_includes[path]
-            else:
-                # Add a querystring to the rendered filename to prevent caching
-                timestamp_path = '%s?%i' % (path, int(time.time()))
+            # Renderer threads share g.compiled_includes, compile each
+            # path only once
+            with _compile_locks_lock:
+                compile_lock = _compile_locks.setdefault(path,
+                                                         threading.Lock())
+
+            with compile_lock:
+                if path in g.compiled_includes:
+                    timestamp_path = g.compiled_includes[path]
+                else:
+                    # Add a querystring to the rendered filename to prevent caching
+                    timestamp = getattr(g, 'includes_timestamp', None)
+                    timestamp_path = '%s?%i' % (path, timestamp or time.time())
+
+                    out_path = 'www/%s' % path
 
-                out_path = 'www/%s' % path
-
-                if path not in g.compiled_includes:
                     logger.info('Rendering %s' % out_path)
 
-                    with codecs.open(out_path, 'w', encoding='utf-8') as f:
-                        f.write(self._compress())
+                    artifacts.write_file(out_path, self._compress())
 
-                # See "fab render"
-                g.compiled_includes[path] = timestamp_path
+                    # See "fab render"
+                    g.compiled_includes[path] = timestamp_path
 
             markup = Markup(self.tag_string % self._relativize_path(timestamp_path))
         else:
@@ -112,9 +238,18 @@ class JavascriptIncluder(Includer):
         for src in self.includes:
             src_paths.append('www/%s' % src)
 
-            with codecs.open('www/%s' % src, encoding='utf-8') as f:
+            with open('www/%s' % src, 'rb') as f:
+                source = f.read()
+
+            key = hashlib.sha1('js:%s:%s' % (
+                _tool_version('slimit'),
+                artifacts.content_hash(source))).hexdigest()
+
+            def compress():
                 logger.info('- compressing %s' % src)
-                output.append(minify(f.read()))
+                return minify(source.decode('utf-8')).encode('utf-8')
+
+            output.append(cached_compression(key, compress).decode('utf-8'))
 
         context = make_context()
         context['paths'] = src_paths
@@ -138,16 +273,24 @@ class CSSIncluder(Includer):
 
         src_paths = []
 
+        less_hash = _less_hash()
+
         for src in self.includes:
 
             src_paths.append('%s' % src)
 
-            try:
-                compressed_src = subprocess.check_output(["node_modules/less/bin/lessc", "-x", src])
-                output.append(compressed_src)
-            except:
-                logger.error('It looks like "lessc" isn\'t installed. Try running: "npm install"')
-                raise
+            key = hashlib.sha1('css:%s:%s:%s:%s' % (
+                _tool_version('lessc'), src, artifacts.file_hash(src),
+                less_hash)).hexdigest()
+
+            def compress():
+                try:
+                    return subprocess.check_output(["node_modules/less/bin/lessc", "-x", src])
+                except:
+                    logger.error('It looks like "lessc" isn\'t installed. Try running: "npm install"')
+                    raise
+
+            output.append(cached_compression(key, compress))
 
         context = make_context()
         context['paths'] = src_paths
@@ -158,19 +301,93 @@ class CSSIncluder(Includer):
 
         return '\n'.join(output)
 
+class FrozenConfig(dict):
+    """
+    Read-only view of the configuration shared by every request
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('The app configuration snapshot is read-only')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+class TemplateContext(MutableMapping):
+    """
+    Variables set for a view layered over the configuration snapshot,
+    which is looked up without being copied
+    """
+    def __init__(self, config, **variables):
+        self.config = config
+        self.variables = variables
+
+    def __getitem__(self, key):
+        try:
+            return self.variables[key]
+        except KeyError:
+            return self.config[key]
+
+    def __setitem__(self, key, value):
+        self.variables[key] = value
+
+    def __delitem__(self, key):
+        del self.variables[key]
+
+    def __iter__(self):
+        for key in self.variables:
+            yield key
+        for key in self.config:
+            if key not in self.variables:
+                yield key
+
+    def __len__(self):
+        return len(self.variables) + sum(1 for key in self.config
+                                         if key not in self.variables)
+
+    def __contains__(self, key):
+        return key in self.variables or key in self.config
+
+
+_config_snapshot = {
+    'generation': None,
+    'config': None,
+    'js': None
+}
+
+
+def get_app_config():
+    """
+    Snapshot of the configuration variables of app_config, rebuilt
+    along with its javascript encoding after configure_targets runs
+    """
+    snapshot = _config_snapshot
+    if snapshot['generation'] != app_config.configuration_generation:
+        config = FrozenConfig()
+        # Only all-caps [constant] vars get included
+        for k, v in app_config.__dict__.items():
+            if k.upper() == k:
+                dict.__setitem__(config, k, v)
+        snapshot['js'] = 'window.APP_CONFIG = ' + json.dumps(
+            config, cls=BetterJSONEncoder)
+        snapshot['config'] = config
+        snapshot['generation'] = app_config.configuration_generation
+    return snapshot['config']
+
+
+def get_app_config_js():
+    """
+    The configuration snapshot as a javascript assignment
+    """
+    get_app_config()
+    return _config_snapshot['js']
+
+
 def flatten_app_config():
     """
     Returns a copy of app_config containing only
     configuration variables.
     """
-    config = {}
-
-    # Only all-caps [constant] vars get included
-    for k, v in app_config.__dict__.items():
-        if k.upper() == k:
-            config[k] = v
-
-    return config
+    return dict(get_app_config())
 
 def make_context(asset_depth=0):
     """
@@ -181,11 +398,9 @@ def make_context(asset_depth=0):
     the assets are hosted. If 0, then they are at the root.
     If 1 then at /foo/, etc.
     """
-    context = flatten_app_config()
-    context['JS'] = JavascriptIncluder(asset_depth=asset_depth)
-    context['CSS'] = CSSIncluder(asset_depth=asset_depth)
-
-    return context
+    return TemplateContext(get_app_config(),
+                           JS=JavascriptIncluder(asset_depth=asset_depth),
+                           CSS=CSSIncluder(asset_depth=asset_depth))
 
 def urlencode_filter(s):
     """
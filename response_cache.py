@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+"""
+Rendered responses of the current document version kept in memory
+together with their compressed variants.
+"""
+import gzip
+import logging
+import threading
+from cStringIO import StringIO
+
+import app_config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+def gzip_compress(data):
+    """
+    Deterministic gzip so that every worker produces the same bytes
+    """
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=5)
+
+COMPRESSORS = [('gzip', gzip_compress)]
+if brotli is not None:
+    COMPRESSORS.insert(0, ('br', brotli_compress))
+
+
+def best_encoding(accept_encodings):
+    """
+    Best encoding of the cached pages accepted by the client
+    """
+    for encoding, compress in COMPRESSORS:
+        if accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+
+class CachedPage(object):
+    """
+    Body of a rendered page and its encodings, compressed on first use
+    """
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        self.encodings = {'identity': body}
+        self.lock = threading.Lock()
+
+    def encode(self, accept_encodings):
+        """
+        Best encoding accepted by the client and the encoded body
+        """
+        encoding = best_encoding(accept_encodings)
+        data = self.encodings.get(encoding)
+        if data is None:
+            with self.lock:
+                data = self.encodings.get(encoding)
+                if data is None:
+                    data = dict(COMPRESSORS)[encoding](
+                        self.encodings['identity'])
+                    self.encodings[encoding] = data
+        return encoding, data
+
+    @property
+    def size(self):
+        return sum(len(data) for data in self.encodings.values())
+
+
+class ResponseCache(object):
+    """
+    Pages rendered for a single version, keyed by request path.
+
+    Storing a page for a new version drops every page of the previous
+    one in a single assignment so a request never mixes versions. No
+    page is added beyond max_pages or max_bytes of bodies.
+    """
+    def __init__(self, max_pages=500, max_bytes=None):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.current = (None, {})
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, key):
+        current_version, pages = self.current
+        page = pages.get(key) if current_version == version else None
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def put(self, version, key, body, content_type):
+        page = CachedPage(body, content_type)
+        current_version, pages = self.current
+        if current_version != version:
+            pages = {}
+            self.current = (version, pages)
+        if len(pages) >= self.max_pages:
+            return page
+        if self.max_bytes is not None:
+            size = sum(cached.size for cached in pages.values())
+            if size + page.size > self.max_bytes:
+                return page
+        pages[key] = page
+        return page
+
+    def clear(self):
+        self.current = (None, {})
+
+    def stats(self):
+        return {
+            'version': self.current[0],
+            'pages': len(self.current[1]),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import json
 from mimetypes import guess_type
 import os
 import subprocess
@@ -10,7 +9,7 @@ from flask import abort, make_response
 import app_config
 import copytext
 from flask import Blueprint
-from render_utils import BetterJSONEncoder, flatten_app_config
+from render_utils import get_app_config_js
 
 static = Blueprint('static', __name__)
 
@@ -34,8 +33,7 @@ def _less(filename):
 # Render application configuration
 @static.route('/js/app_config.js')
 def _app_config_js():
-    config = flatten_app_config()
-    js = 'window.APP_CONFIG = ' + json.dumps(config, cls=BetterJSONEncoder)
+    js = get_app_config_js()
 
     return make_response(js, 200, { 'Content-Type': 'application/javascript' })
 
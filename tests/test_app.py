@@ -1,10 +1,20 @@
 #!/usr/bin/env python
 
+import gzip
 import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+from StringIO import StringIO
 
 import app
 import app_config
+import documents
+import render_utils
+import response_cache
+from test_parse_doc import ANNOTATION, build_html
 
 class IndexTestCase(unittest.TestCase):
     """
@@ -13,11 +23,18 @@ class IndexTestCase(unittest.TestCase):
     def setUp(self):
         app.app.config['TESTING'] = True
         self.client = app.app.test_client()
+        # Without a google doc key the index does not require oauth
+        self.gdoc_key = app_config.TRANSCRIPT_GDOC_KEY
+        app_config.TRANSCRIPT_GDOC_KEY = None
+
+    def tearDown(self):
+        app_config.TRANSCRIPT_GDOC_KEY = self.gdoc_key
 
     def test_index_exists(self):
         response = self.client.get('/')
 
-        assert app_config.PROJECT_SLUG in response.data
+        assert response.status_code == 200
+        assert 'data-child-src="child.html"' in response.data
 
 class AppConfigTestCase(unittest.TestCase):
     """
@@ -51,5 +68,395 @@ class AppConfigTestCase(unittest.TestCase):
         
         app_config.configure_targets('staging')
 
+    def test_config_snapshot(self):
+        config = render_utils.get_app_config()
+
+        assert render_utils.get_app_config() is config
+        self.assertRaises(TypeError, config.__setitem__, 'DEBUG', False)
+
+        app_config.configure_targets('production')
+        production = render_utils.get_app_config()
+        app_config.configure_targets('staging')
+
+        assert production is not config
+        assert production['DEBUG'] == False
+
+    def test_context(self):
+        context = render_utils.make_context()
+        context['DEBUG'] = 'overridden'
+        context['extra'] = 1
+
+        assert context['DEBUG'] == 'overridden'
+        assert render_utils.get_app_config()['DEBUG'] != 'overridden'
+        assert dict(**context)['extra'] == 1
+        assert len(dict(context)) == len(context)
+        assert 'JS' in context and 'PROJECT_SLUG' in context
+
+class TranscriptTestCase(unittest.TestCase):
+    """
+    Serve a transcript written to a temporary directory.
+    """
+    def setUp(self):
+        app.app.config['TESTING'] = True
+        self.client = app.app.test_client()
+        self.tmpdir = tempfile.mkdtemp()
+        self.html_path = app_config.TRANSCRIPT_HTML_PATH
+        app_config.TRANSCRIPT_HTML_PATH = os.path.join(self.tmpdir,
+                                                       'transcript.html')
+        with open(app_config.TRANSCRIPT_HTML_PATH, 'w') as f:
+            f.write(build_html(['DONALD TRUMP: First.',
+                                'HILLARY CLINTON: Second.'] + ANNOTATION))
+
+    def tearDown(self):
+        app_config.TRANSCRIPT_HTML_PATH = self.html_path
+        shutil.rmtree(self.tmpdir)
+
+
+
+class EmbedTestCase(TranscriptTestCase):
+    """
+    Test the annotation embeds.
+    """
+    def test_embed(self):
+        response = self.client.get('/embeds/first-check.html')
+
+        assert response.status_code == 200
+        assert 'Second.' in response.data
+        assert 'First.' not in response.data
+
+    def test_unknown_slug(self):
+        response = self.client.get('/embeds/missing.html')
+
+        assert response.status_code == 404
+
+    def test_embed_list(self):
+        response = self.client.get('/embeds/')
+
+        assert 'first-check' in response.data
+
+class RenderEngineTestCase(TranscriptTestCase):
+    """
+    Test rendering the transcript pages without a request.
+    """
+    def test_preview(self):
+        published = self.client.get('/factcheck.html').data
+        preview = self.client.get('/factcheck_preview.html').data
+
+        assert 'preview-msg' in preview
+        assert 'preview-msg' not in published
+
+    def test_same_as_views(self):
+        parsed = documents.load_document()
+        context = app.engine.context(parsed, app.delta_history.add(parsed))
+
+        assert app.engine.context(parsed, context['live_version']) is context
+        assert (app.engine.embed(context, 'first-check').encode('utf-8') ==
+                self.client.get('/embeds/first-check.html').data)
+        assert (app.engine.factcheck(context).encode('utf-8') ==
+                self.client.get('/factcheck.html').data)
+        assert app.engine.embed(context, 'missing') is None
+
+class ConditionalGetTestCase(TranscriptTestCase):
+    """
+    Test revalidating the transcript views.
+    """
+    def test_if_none_match(self):
+        response = self.client.get('/factcheck.html')
+        etag = response.headers['ETag']
+
+        response = self.client.get('/factcheck.html',
+                                   headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert response.data == ''
+
+    def test_window_etag(self):
+        etag = self.client.get('/factcheck.html').headers['ETag']
+
+        response = self.client.get('/factcheck.html?from=0&limit=1',
+                                   headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_encoding_etag(self):
+        etag = self.client.get('/factcheck.html').headers['ETag']
+
+        response = self.client.get('/factcheck.html', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert self.client.get('/factcheck.html', headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    def test_if_modified_since(self):
+        response = self.client.get('/share.html')
+        last_modified = response.headers['Last-Modified']
+
+        response = self.client.get('/share.html', headers={
+            'If-Modified-Since': last_modified})
+
+        assert response.status_code == 304
+
+    def test_changed_document(self):
+        response = self.client.get('/factcheck.html')
+        etag = response.headers['ETag']
+        with open(app_config.TRANSCRIPT_HTML_PATH, 'w') as f:
+            f.write(build_html(['DONALD TRUMP: Changed.']))
+        os.utime(app_config.TRANSCRIPT_HTML_PATH, (1000, 1000))
+
+        response = self.client.get('/factcheck.html',
+                                   headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert 'Changed.' in response.data
+        assert response.headers['ETag'] != etag
+
+    def test_templates_walked_once(self):
+        walks = []
+        walk_templates = app.walk_templates
+        debug = app_config.DEBUG
+        app.walk_templates = lambda: walks.append(1) or walk_templates()
+        app_config.DEBUG = False
+        try:
+            app.templates_state = (0, None)
+            fingerprint = app.get_templates_fingerprint()
+            self.client.get('/factcheck.html')
+            self.client.get('/share.html')
+        finally:
+            app.walk_templates = walk_templates
+            app_config.DEBUG = debug
+
+        assert len(walks) == 1
+        assert app.get_templates_fingerprint() == fingerprint
+
+
+class PageCacheTestCase(TranscriptTestCase):
+    """
+    Test serving the transcript views from the page cache.
+    """
+    def setUp(self):
+        super(PageCacheTestCase, self).setUp()
+        app.page_cache.clear()
+
+    def test_cached_page(self):
+        first = self.client.get('/factcheck_preview.html')
+        hits = app.page_cache.hits
+        second = self.client.get('/factcheck_preview.html')
+
+        assert app.page_cache.hits == hits + 1
+        assert second.data == first.data
+        assert second.headers['Vary'] == 'Accept-Encoding'
+
+    def test_gzip(self):
+        plain = self.client.get('/share.html')
+        response = self.client.get('/share.html', headers={
+            'Accept-Encoding': 'gzip, deflate'})
+
+        assert response.headers['Content-Encoding'] in ('gzip', 'br')
+        if response.headers['Content-Encoding'] == 'gzip':
+            f = gzip.GzipFile(fileobj=StringIO(response.data))
+            assert f.read() == plain.data
+
+    def test_new_version(self):
+        self.client.get('/factcheck.html')
+        with open(app_config.TRANSCRIPT_HTML_PATH, 'w') as f:
+            f.write(build_html(['DONALD TRUMP: Changed.']))
+        os.utime(app_config.TRANSCRIPT_HTML_PATH, (1000, 1000))
+
+        response = self.client.get('/factcheck.html')
+
+        assert 'Changed.' in response.data
+        assert app.page_cache.stats()['pages'] == 1
+
+    def test_ignored_arguments(self):
+        self.client.get('/factcheck.html?limit=1&from=0')
+        self.client.get('/factcheck.html?from=0&limit=1&utm_source=x')
+        self.client.get('/factcheck.html?cachebuster=1')
+        self.client.get('/factcheck.html')
+
+        assert app.page_cache.stats()['pages'] == 2
+
+    def test_uncached_windows(self):
+        self.client.get('/factcheck.html?from=1&limit=2')
+        self.client.get('/factcheck.json?since=unknown')
+
+        assert app.page_cache.stats()['pages'] == 0
+        response = self.client.get('/factcheck.html?from=1&limit=2')
+        assert response.status_code == 200
+
+    def test_max_bytes(self):
+        pages = response_cache.ResponseCache(max_pages=10, max_bytes=10)
+        pages.put('v1', 'a', 'x' * 6, 'text/html')
+        pages.put('v1', 'b', 'x' * 6, 'text/html')
+
+        assert pages.get('v1', 'a') is not None
+        assert pages.get('v1', 'b') is None
+
+class FactcheckWindowTestCase(TranscriptTestCase):
+    """
+    Test streaming and windowing the factcheck page.
+    """
+    def tearDown(self):
+        super(FactcheckWindowTestCase, self).tearDown()
+        app_config.STREAM_FACTCHECK = False
+        app_config.RESPONSE_CACHE = True
+
+    def test_window(self):
+        response = self.client.get('/factcheck_preview.html?from=1&limit=1')
+
+        assert 'Second.' in response.data
+        assert 'First.' not in response.data
+        assert 'first-check' not in response.data
+
+    def test_stream(self):
+        rendered = self.client.get('/factcheck.html?limit=10').data
+        app_config.STREAM_FACTCHECK = True
+        app_config.RESPONSE_CACHE = False
+
+        streamed = self.client.get('/factcheck.html?limit=10')
+        assert streamed.data == rendered
+
+    def test_no_stream_when_cached(self):
+        rendered = self.client.get('/factcheck.html').data
+        app_config.STREAM_FACTCHECK = True
+        app.page_cache.clear()
+
+        response = self.client.get('/factcheck.html')
+        assert response.data == rendered
+        assert 'Content-Length' in response.headers
+        assert app.page_cache.stats()['pages'] == 1
+
+class DeltaTestCase(TranscriptTestCase):
+    """
+    Test the json delta feed.
+    """
+    def test_delta_since(self):
+        full = json.loads(self.client.get('/factcheck.json').data)
+        with open(app_config.TRANSCRIPT_HTML_PATH, 'w') as f:
+            f.write(build_html(['DONALD TRUMP: First.',
+                                'HILLARY CLINTON: Second.',
+                                'DONALD TRUMP: Third.'] + ANNOTATION))
+        os.utime(app_config.TRANSCRIPT_HTML_PATH, (1000, 1000))
+
+        response = self.client.get('/factcheck.json?since=%s' %
+                                   full['version'])
+        delta = json.loads(response.data)
+
+        assert full['full']
+        assert len(full['inserted']) == 3
+        assert not delta['full']
+        assert len(delta['inserted']) == 1
+        assert delta['inserted'][0]['after'] == full['inserted'][1]['id']
+        assert 'Third.' in delta['inserted'][0]['markup']
+
+    def test_draft_annotation(self):
+        draft = [line for line in ANNOTATION
+                 if not line.startswith('Published')]
+        with open(app_config.TRANSCRIPT_HTML_PATH, 'w') as f:
+            f.write(build_html(['DONALD TRUMP: First.'] + draft))
+
+        assert self.client.get('/factcheck.html').status_code == 200
+        assert self.client.get('/factcheck.json').status_code == 200
+
+class IncluderTestCase(unittest.TestCase):
+    """
+    Test compiling assets from several render threads.
+    """
+    def setUp(self):
+        self.path = 'js/test-includer.min.js'
+        self.compressed = 0
+
+        def compress(includer):
+            self.compressed += 1
+            return u'// compressed'
+        self.includer_class = type('CountingIncluder',
+                                   (render_utils.JavascriptIncluder,),
+                                   {'_compress': compress})
+
+    def tearDown(self):
+        os.remove('www/%s' % self.path)
+
+    def test_compile_once(self):
+        from flask import g
+
+        compiled_includes = {}
+        markups = []
+
+        def render():
+            with app.app.test_request_context(path='/child.html'):
+                g.compile_includes = True
+                g.compiled_includes = compiled_includes
+                g.includes_timestamp = 1000
+                includer = self.includer_class()
+                includer.push('js/app.js')
+                markups.append(includer.render(self.path))
+        threads = [threading.Thread(target=render) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert self.compressed == 1
+        assert len(set(markups)) == 1
+        assert '%s?1000' % self.path in markups[0]
+
+class CompressionCacheTestCase(unittest.TestCase):
+    """
+    Test reusing minified javascript between renders.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_path = app_config.COMPRESSION_CACHE_PATH
+        app_config.COMPRESSION_CACHE_PATH = os.path.join(self.tmpdir, 'cache')
+        self.src = 'js/test-compression-cache.js'
+        self.minify = render_utils.minify
+        self.minified = 0
+
+        def counting_minify(source):
+            self.minified += 1
+            return self.minify(source)
+        render_utils.minify = counting_minify
+
+    def tearDown(self):
+        render_utils.minify = self.minify
+        app_config.COMPRESSION_CACHE_PATH = self.cache_path
+        os.remove('www/%s' % self.src)
+        shutil.rmtree(self.tmpdir)
+
+    def compress(self, source):
+        with open('www/%s' % self.src, 'w') as f:
+            f.write(source)
+        with app.app.test_request_context(path='/'):
+            includer = render_utils.JavascriptIncluder()
+            includer.push(self.src)
+            return includer._compress()
+
+    def test_cache(self):
+        first = self.compress('var answer = 40 + 2;\n')
+        again = self.compress('var answer = 40 + 2;\n')
+
+        assert first == again
+        assert 'var answer' in first
+        assert self.minified == 1
+
+        self.compress('var answer = 42;\n')
+        assert self.minified == 2
+
+    def test_prune(self):
+        size = app_config.COMPRESSION_CACHE_SIZE
+        app_config.COMPRESSION_CACHE_SIZE = 1
+        try:
+            self.compress('var answer = 40 + 2;\n')
+            self.compress('var answer = 42;\n')
+        finally:
+            app_config.COMPRESSION_CACHE_SIZE = size
+
+        assert len(os.listdir(app_config.COMPRESSION_CACHE_PATH)) == 1
+        self.compress('var answer = 42;\n')
+        assert self.minified == 2
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import artifacts
+from fabfile import flat
+
+
+class ArtifactsTestCase(unittest.TestCase):
+    """
+    Test writing rendered files and tracking the changed ones.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.tmpdir, 'manifest.json')
+        self.manifest = artifacts.ChangeManifest(self.manifest_path)
+        self.root = os.path.join(self.tmpdir, 'www')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        return artifacts.write_file(os.path.join(self.root, name), data,
+                                    self.manifest)
+
+    def test_write_only_changes(self):
+        path = os.path.join(self.root, 'embeds', 'a.html')
+        self.assertTrue(self.write('embeds/a.html', u'<p>café</p>'))
+        os.utime(path, (1000, 1000))
+        self.assertFalse(self.write('embeds/a.html', u'<p>café</p>'))
+        self.assertEqual(os.stat(path).st_mtime, 1000)
+        self.assertTrue(self.write('embeds/a.html', '<p>tea</p>'))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['a.html'])
+        self.assertEqual(self.manifest.changed_under(self.root), [path])
+
+    def pending(self, manifest, bucket_name='bucket', dst='dst'):
+        sequence, src_paths, removed = manifest.pending(self.root,
+                                                        bucket_name, dst)
+        return sequence, flat.files_to_deploy(self.root, dst,
+                                              src_paths=src_paths)
+
+    def test_deploy_from_manifest(self):
+        self.write('a.html', 'a')
+        self.write('b.html', 'b')
+        sequence, to_deploy = self.pending(self.manifest)
+        self.assertEqual(len(to_deploy), 2)
+
+        # Nothing changed once the folder was deployed
+        self.manifest.deployed(self.root, 'bucket', 'dst', sequence)
+        self.assertEqual(self.pending(self.manifest)[1], [])
+
+        self.write('b.html', 'c')
+        self.write('d.html', 'd')
+        artifacts.remove_file(os.path.join(self.root, 'd.html'),
+                              self.manifest)
+        self.manifest.save()
+
+        manifest = artifacts.ChangeManifest(self.manifest_path)
+        self.assertEqual(self.pending(manifest)[1],
+                         [(os.path.join(self.root, 'b.html'), 'dst/b.html')])
+
+    def test_deploy_per_destination(self):
+        self.write('a.html', 'a')
+        sequence, to_deploy = self.pending(self.manifest)
+        self.manifest.deployed(self.root, 'bucket', 'dst', sequence)
+
+        # Other destinations are deployed in full until recorded
+        self.assertEqual(len(self.pending(self.manifest, 'other')[1]), 1)
+        self.assertEqual(len(self.pending(self.manifest, dst='new')[1]), 1)
+        sequence, to_deploy = self.pending(self.manifest, 'other')
+        self.manifest.deployed(self.root, 'other', 'dst', sequence)
+
+        # A change is kept until every destination deployed it
+        self.write('b.html', 'b')
+        sequence, to_deploy = self.pending(self.manifest)
+        self.manifest.deployed(self.root, 'bucket', 'dst', sequence)
+        self.assertEqual(self.pending(self.manifest)[1], [])
+        self.assertEqual(self.pending(self.manifest, 'other')[1],
+                         [(os.path.join(self.root, 'b.html'), 'dst/b.html')])
+
+        sequence, to_deploy = self.pending(self.manifest, 'other')
+        self.manifest.deployed(self.root, 'other', 'dst', sequence)
+        self.assertEqual(self.manifest.changed, {})
+
+    def test_delete_removed(self):
+        self.write('a.html', 'a')
+        self.write('b.html', 'b')
+        sequence, to_deploy = self.pending(self.manifest)
+        self.manifest.deployed(self.root, 'bucket', 'dst', sequence)
+
+        artifacts.remove_file(os.path.join(self.root, 'a.html'),
+                              self.manifest)
+        self.manifest.save()
+        manifest = artifacts.ChangeManifest(self.manifest_path)
+        sequence, src_paths, removed = manifest.pending(self.root,
+                                                        'bucket', 'dst')
+        self.assertEqual(src_paths, [])
+        self.assertEqual(flat.files_to_delete(self.root, 'dst', removed),
+                         ['dst/a.html'])
+
+        # Written again before the deploy, it is uploaded instead
+        self.write('a.html', 'c')
+        sequence, src_paths, removed = self.manifest.pending(self.root,
+                                                             'bucket', 'dst')
+        self.assertEqual(removed, [])
+
+        self.manifest.deployed(self.root, 'bucket', 'dst', sequence)
+        self.assertEqual(self.manifest.removed, {})
+
+    def test_merge_processes(self):
+        deploy = artifacts.ChangeManifest(self.manifest_path)
+        self.write('a.html', 'a')
+        self.manifest.save()
+
+        # Written by the daemon while the deploy uploads the folder
+        deploy.save()
+        sequence, to_deploy = self.pending(deploy)
+        self.write('b.html', 'b')
+        self.manifest.save()
+        deploy.deployed(self.root, 'bucket', 'dst', sequence)
+        deploy.save()
+
+        # Only the file written during the upload is left to deploy
+        self.manifest.save()
+        self.assertEqual(self.pending(self.manifest)[1],
+                         [(os.path.join(self.root, 'b.html'), 'dst/b.html')])
+
+if __name__ == '__main__':
+    unittest.main()
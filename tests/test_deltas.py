@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+import deltas
+from test_parse_doc import ANNOTATION, parse
+
+
+class PublishedEntriesTestCase(unittest.TestCase):
+    """
+    Test the stable ids of the published entries.
+    """
+    def test_ids(self):
+        context = parse(['DONALD TRUMP: Hello.', 'Other',
+                         'DONALD TRUMP: Hello.'] + ANNOTATION)
+        ids = deltas.published_entries(context['contents']).keys()
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(ids[2], '%s-1' % ids[0])
+        self.assertEqual(ids[3], 'a-first-check')
+
+    def test_drafts(self):
+        draft = [line.replace('Yes', 'No') for line in ANNOTATION]
+        context = parse(['DONALD TRUMP: Hello.'] + draft)
+        entries = deltas.published_entries(context['contents'])
+        self.assertEqual(len(entries), 1)
+
+    def test_incomplete_annotations(self):
+        unpublished = [line for line in ANNOTATION
+                       if not line.startswith('Published')]
+        no_slug = [line for line in ANNOTATION
+                   if not line.startswith('Slug')]
+        context = parse(['DONALD TRUMP: Hello.'] + unpublished + no_slug)
+        ids = deltas.published_entries(context['contents']).keys()
+        self.assertEqual(len(ids), 2)
+        self.assertTrue(ids[1].startswith('p-'))
+
+
+class ComputeDeltaTestCase(unittest.TestCase):
+    """
+    Test the changes between two versions.
+    """
+    def test_changes(self):
+        old = OrderedDict([('a', '1'), ('b', '2'), ('c', '3')])
+        new = OrderedDict([('a', '1'), ('c', '4'), ('d', '5')])
+        delta = deltas.compute_delta(old, new)
+        self.assertEqual(delta['inserted'], [{'id': 'd', 'after': 'c',
+                                              'markup': '5'}])
+        self.assertEqual(delta['updated'], [{'id': 'c', 'markup': '4'}])
+        self.assertEqual(delta['removed'], ['b'])
+
+    def test_moved(self):
+        old = OrderedDict([('a', '1'), ('b', '2'), ('c', '3')])
+        new = OrderedDict([('a', '1'), ('c', '3'), ('b', '2')])
+        delta = deltas.compute_delta(old, new)
+        self.assertEqual(delta['removed'], ['b'])
+        self.assertEqual(delta['inserted'], [{'id': 'b', 'after': 'c',
+                                              'markup': '2'}])
+
+
+class DeltaHistoryTestCase(unittest.TestCase):
+    """
+    Test answering deltas from previous versions.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'deltas.history')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_delta(self):
+        history = deltas.DeltaHistory(path=self.path)
+        first = history.add(parse(['DONALD TRUMP: Hello.']))
+        second = history.add(parse(['DONALD TRUMP: Hello.',
+                                    'HILLARY CLINTON: Bye.']))
+        delta = history.delta(first)
+        self.assertEqual(delta['version'], second)
+        self.assertFalse(delta['full'])
+        self.assertEqual(len(delta['inserted']), 1)
+        self.assertTrue(history.delta('unknown')['full'])
+
+    def test_persist(self):
+        history = deltas.DeltaHistory(max_versions=2, path=self.path)
+        first = history.add(parse(['DONALD TRUMP: One.']))
+        history.add(parse(['DONALD TRUMP: Two.']))
+        history.add(parse(['DONALD TRUMP: Three.']))
+        history.save()
+        restored = deltas.DeltaHistory(max_versions=2, path=self.path)
+        self.assertEqual(restored.versions, history.versions)
+        self.assertNotIn(first, restored.versions)
+        self.assertEqual(restored.delta(None), history.delta(None))
+
+    def test_markups_stored_once(self):
+        history = deltas.DeltaHistory(max_versions=2, path=self.path)
+        history.add(parse(['DONALD TRUMP: One.']))
+        history.add(parse(['DONALD TRUMP: One.', 'DONALD TRUMP: Two.']))
+        self.assertEqual(len(history.markups), 2)
+        history.add(parse(['DONALD TRUMP: Three.']))
+        self.assertEqual(len(history.markups), 3)
+        history.add(parse(['DONALD TRUMP: Four.']))
+        self.assertEqual(len(history.markups), 2)
+
+    def test_save_when_changed(self):
+        history = deltas.DeltaHistory(path=self.path)
+        history.add(parse(['DONALD TRUMP: One.']))
+        history.save()
+        os.remove(self.path)
+        history.add(parse(['DONALD TRUMP: One.']))
+        history.save()
+        self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
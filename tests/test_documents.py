@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import app_config
+import documents
+from test_parse_doc import ANNOTATION, build_html
+
+
+class DocumentTestCase(unittest.TestCase):
+    """
+    Write transcripts to a temporary directory and count the parses.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.html_path = os.path.join(self.tmpdir, 'transcript.html')
+        self.parse_document = documents.parse_document
+        self.parses = 0
+
+        def counting_parse(html, incremental=None):
+            self.parses += 1
+            return self.parse_document(html, incremental)
+        documents.parse_document = counting_parse
+
+    def tearDown(self):
+        documents.parse_document = self.parse_document
+        shutil.rmtree(self.tmpdir)
+
+    def write_html(self, paragraphs):
+        with open(self.html_path, 'w') as f:
+            f.write(build_html(paragraphs))
+
+
+class SnapshotTestCase(DocumentTestCase):
+    """
+    Test sharing parsed documents through snapshot files.
+    """
+    def test_reuse_snapshot(self):
+        self.write_html(['DONALD TRUMP: Hello.'] + ANNOTATION)
+        first = documents.load_document(self.html_path)
+        second = documents.load_document(self.html_path)
+        self.assertEqual(self.parses, 1)
+        self.assertEqual(first, second)
+        self.assertTrue(os.path.exists(
+            documents.snapshot_path(self.html_path)))
+
+    def test_reparse_on_change(self):
+        self.write_html(['DONALD TRUMP: Hello.'])
+        documents.load_document(self.html_path)
+        self.write_html(['DONALD TRUMP: Hello again.'])
+        parsed = documents.load_document(self.html_path)
+        self.assertEqual(self.parses, 2)
+        self.assertIn('Hello again.', parsed['contents'][0]['markup'])
+
+    def test_stale_version(self):
+        self.write_html(['DONALD TRUMP: Hello.'])
+        with open(self.html_path) as f:
+            key = documents.document_key(f.read())
+        path = documents.snapshot_path(self.html_path)
+        documents.write_snapshot(path, key, {'contents': [], 'status': None})
+        key['version'] = documents.SNAPSHOT_VERSION + 1
+        self.assertIsNone(documents.read_snapshot(path, key))
+
+
+class DocumentCacheTestCase(DocumentTestCase):
+    """
+    Test the in-process parsed document cache.
+    """
+    def test_reparse_on_change(self):
+        self.write_html(['DONALD TRUMP: Hello.'])
+        cache = documents.DocumentCache(self.html_path)
+        first = cache.get()
+        self.assertIs(cache.get(), first)
+        self.assertEqual(cache.stats()['reparses'], 1)
+
+        self.write_html(['DONALD TRUMP: Hello again.'])
+        os.utime(self.html_path, (1000, 1000))
+        second = cache.get()
+        self.assertIn('Hello again.', second['contents'][0]['markup'])
+        self.assertEqual(cache.stats()['reparses'], 2)
+
+    def test_touch_without_change(self):
+        self.write_html(['DONALD TRUMP: Hello.'])
+        cache = documents.DocumentCache(self.html_path)
+        first = cache.get()
+        os.utime(self.html_path, (1000, 1000))
+        self.assertIs(cache.get(), first)
+        self.assertEqual(cache.stats()['reparses'], 1)
+
+    def test_reparse_on_authors_change(self):
+        authors_path = app_config.AUTHORS_PATH
+        app_config.AUTHORS_PATH = os.path.join(self.tmpdir, 'authors.xlsx')
+        try:
+            self.write_html(['DONALD TRUMP: Hello.'])
+            cache = documents.DocumentCache(self.html_path)
+            cache.get()
+            version = cache.peek_version()
+            with open(app_config.AUTHORS_PATH, 'w') as f:
+                f.write('authors')
+            self.assertNotEqual(cache.peek_version(), version)
+            cache.get()
+            self.assertEqual(cache.version, cache.peek_version())
+            self.assertEqual(cache.stats()['reparses'], 2)
+        finally:
+            app_config.AUTHORS_PATH = authors_path
+
+    def test_single_flight(self):
+        self.write_html(['DONALD TRUMP: Hello.'])
+        cache = documents.DocumentCache(self.html_path)
+        results = []
+
+        def get():
+            results.append(cache.get())
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.parses, 1)
+        self.assertEqual(len(set(id(r) for r in results)), 1)
+
+
+class DocumentCacheLRUTestCase(unittest.TestCase):
+    """
+    Test bounding the number of documents kept in memory.
+    """
+    def setUp(self):
+        self.size = app_config.DOCUMENT_CACHE_SIZE
+        app_config.DOCUMENT_CACHE_SIZE = 2
+
+    def tearDown(self):
+        app_config.DOCUMENT_CACHE_SIZE = self.size
+
+    def test_evict_least_recently_used(self):
+        first = documents.get_document_cache('/tmp/first.html')
+        second = documents.get_document_cache('/tmp/second.html')
+        self.assertIs(documents.get_document_cache('/tmp/first.html'), first)
+        documents.get_document_cache('/tmp/third.html')
+        self.assertIs(documents.get_document_cache('/tmp/first.html'), first)
+        self.assertIsNot(documents.get_document_cache('/tmp/second.html'),
+                         second)
+
+    def test_document_path(self):
+        self.assertTrue(documents.document_path('senate-hearing_2').endswith(
+            'senate-hearing_2.html'))
+        for key in ['', '../secrets', 'a/b', 'a.html', 'x' * 200]:
+            self.assertIsNone(documents.document_path(key))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import Environment, DictLoader
+
+from fragment_cache import FragmentCache
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    """
+    Test the rendered fragment cache.
+    """
+    def setUp(self):
+        self.env = Environment(loader=DictLoader({
+            'speaker.html': '<h4>{{speaker}}</h4>'
+        }))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hits_and_misses(self):
+        cache = FragmentCache(self.env)
+        markup = cache.render('speaker.html', {'speaker': 'A'})
+        again = cache.render('speaker.html', {'speaker': 'A'})
+        cache.render('speaker.html', {'speaker': 'B'})
+        self.assertEqual(markup, '<h4>A</h4>')
+        self.assertEqual(again, markup)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_lru_eviction(self):
+        cache = FragmentCache(self.env, max_size=2)
+        cache.render('speaker.html', {'speaker': 'A'})
+        cache.render('speaker.html', {'speaker': 'B'})
+        # Touch A so that B becomes the least recently used
+        cache.render('speaker.html', {'speaker': 'A'})
+        cache.render('speaker.html', {'speaker': 'C'})
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.render('speaker.html', {'speaker': 'A'})
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_persistence(self):
+        path = os.path.join(self.tmpdir, 'fragments.pickle')
+        cache = FragmentCache(self.env, path=path)
+        cache.render('speaker.html', {'speaker': 'A'})
+        cache.save()
+        warm = FragmentCache(self.env, path=path)
+        warm.render('speaker.html', {'speaker': 'A'})
+        self.assertEqual(warm.stats()['hits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import app_config
+import instrumentation
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """
+    Test timing the phases of the daemon cycles.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.settings = (app_config.INSTRUMENTATION,
+                         app_config.INSTRUMENTATION_LOG_PATH)
+        app_config.INSTRUMENTATION = True
+        app_config.INSTRUMENTATION_LOG_PATH = os.path.join(self.tmpdir,
+                                                           'pipeline.jsonl')
+        self.recorder = instrumentation.recorder
+        instrumentation.recorder = instrumentation.Recorder(window=10)
+
+        @instrumentation.timed('parse')
+        def parse(text):
+            return text.upper()
+        self.parse = parse
+
+    def tearDown(self):
+        (app_config.INSTRUMENTATION,
+         app_config.INSTRUMENTATION_LOG_PATH) = self.settings
+        instrumentation.recorder = self.recorder
+        shutil.rmtree(self.tmpdir)
+
+    def test_cycle_record(self):
+        instrumentation.start_cycle()
+        self.assertEqual(self.parse('a'), 'A')
+        self.parse('b')
+        with instrumentation.timer('upload'):
+            instrumentation.incr('uploaded', 2)
+        record = instrumentation.end_cycle()
+
+        self.assertEqual(record['phases']['parse']['count'], 2)
+        self.assertEqual(record['phases']['upload']['count'], 1)
+        self.assertEqual(record['counters'], {'uploaded': 2})
+        with open(app_config.INSTRUMENTATION_LOG_PATH) as f:
+            self.assertEqual(json.loads(f.readline()), record)
+
+        # Totals are reset for the next cycle
+        record = instrumentation.end_cycle()
+        self.assertEqual(record['cycle'], 2)
+        self.assertEqual(record['phases'], {})
+
+    def test_disabled(self):
+        app_config.INSTRUMENTATION = False
+        self.assertEqual(self.parse('a'), 'A')
+        instrumentation.incr('uploaded')
+        self.assertIsNone(instrumentation.end_cycle())
+        self.assertEqual(instrumentation.recorder.phases, {})
+        self.assertFalse(os.path.exists(app_config.INSTRUMENTATION_LOG_PATH))
+
+    def test_summary(self):
+        recorder = instrumentation.recorder
+        for seconds in range(1, 21):
+            recorder.add_time('render_embeds', seconds)
+            recorder.end_cycle()
+        summary = recorder.summary()['render_embeds']
+        self.assertEqual(summary['cycles'], 10)
+        self.assertEqual(summary['p50'], 15)
+        self.assertEqual(summary['p95'], 20)
+
+if __name__ == '__main__':
+    unittest.main()
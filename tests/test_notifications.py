@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import app_config
+import notifications
+import public_app
+
+
+class VersionWatcherTestCase(unittest.TestCase):
+    """
+    Test waking up requests waiting for a new published version.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'published_version.json')
+        self.watchers = []
+
+    def tearDown(self):
+        for watcher in self.watchers:
+            watcher.stop()
+            if watcher.thread:
+                watcher.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def watch(self):
+        watcher = notifications.VersionWatcher(self.path, interval=0.05)
+        self.watchers.append(watcher)
+        return watcher
+
+    def test_publish_once(self):
+        self.assertTrue(notifications.publish_version('v1', 'during',
+                                                      self.path))
+        self.assertFalse(notifications.publish_version('v1', 'during',
+                                                       self.path))
+        published = notifications.read_published_version(self.path)
+        self.assertEqual(published['version'], 'v1')
+
+    def test_outdated_client(self):
+        notifications.publish_version('v1', 'during', self.path)
+        watcher = self.watch()
+        start = time.time()
+        published = watcher.wait('v0', 5)
+        self.assertEqual(published['version'], 'v1')
+        self.assertTrue(time.time() - start < 1)
+
+    def test_wake_up(self):
+        notifications.publish_version('v1', 'during', self.path)
+        watcher = self.watch()
+        timer = threading.Timer(0.2, notifications.publish_version,
+                                ('v2', 'after', self.path))
+        timer.start()
+        published = watcher.wait('v1', 5)
+        timer.join()
+        self.assertEqual(published['version'], 'v2')
+        self.assertEqual(published['status'], 'after')
+
+    def test_timeout(self):
+        watcher = self.watch()
+        self.assertIsNone(watcher.wait(None, 0.1))
+
+
+class LiveRoutesTestCase(unittest.TestCase):
+    """
+    Test the live routes are only served when notifications are enabled.
+    """
+    def test_disabled(self):
+        self.assertFalse(app_config.LIVE_NOTIFICATIONS)
+        client = public_app.app.test_client()
+        for route in ('live/version.json', 'live/events'):
+            response = client.get('/%s/%s' % (app_config.PROJECT_SLUG,
+                                               route))
+            self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import threading
+import time
+import unittest
+
+import oauth
+
+
+class DocRefresherTestCase(unittest.TestCase):
+    """
+    Test refreshing the google doc in the background.
+    """
+    def setUp(self):
+        self.release = threading.Event()
+        self.fetches = []
+
+    def fetch(self, key, file_path):
+        self.fetches.append(key)
+        self.release.wait(5)
+
+    def wait_for(self, refresher):
+        self.release.set()
+        while refresher.running:
+            time.sleep(0.01)
+
+    def test_single_flight(self):
+        refresher = oauth.DocRefresher('key', '/tmp/doc.html', fetch=self.fetch)
+        self.assertEqual(refresher.refresh(), 'started')
+        self.assertEqual(refresher.refresh(), 'running')
+        self.assertEqual(refresher.refresh(), 'running')
+        self.wait_for(refresher)
+        self.assertEqual(self.fetches, ['key'])
+        self.assertEqual(refresher.refresh(), 'started')
+        self.wait_for(refresher)
+
+    def test_min_interval(self):
+        refresher = oauth.DocRefresher('key', '/tmp/doc.html',
+                                       min_interval=60, fetch=self.fetch)
+        self.assertEqual(refresher.refresh(), 'started')
+        self.wait_for(refresher)
+        self.assertEqual(refresher.refresh(), 'throttled')
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_error(self):
+        def fail(key, file_path):
+            raise KeyError('Google returned a 500 error')
+        refresher = oauth.DocRefresher('key', '/tmp/doc.html', fetch=fail)
+        refresher.refresh()
+        self.wait_for(refresher)
+        self.assertIn('500', refresher.error)
+
+if __name__ == '__main__':
+    unittest.main()
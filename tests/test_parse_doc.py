@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from copydoc import CopyDoc
+from openpyxl import Workbook
+
+import app_config
+import parse_doc
+
+AUTHORS = {
+    'dm': {
+        'initials': 'dm',
+        'name': 'Domenico Montanaro',
+        'role': 'NPR Political Editor & Digital Audience',
+        'page': 'http://www.npr.org/people/xxxx',
+        'img': 'http://media.npr.org/assets/img/yyy.jpg'
+    }
+}
+
+ANNOTATION = [
+    '+' * 60,
+    '---',
+    'Slug: first-check',
+    'Published: Yes',
+    'Author: Domenico Montanaro (dm)',
+    '---',
+    'This is the annotation.',
+    '-' * 60
+]
+
+
+def build_html(paragraphs, tail=None):
+    """
+    Build a Google Docs style export out of a list of paragraph texts
+    """
+    body = ''.join(['<p><span>%s</span></p>' % p for p in paragraphs])
+    if tail:
+        body += '<hr><p><span>%s</span></p>' % tail
+    return '<html><head></head><body>%s</body></html>' % body
+
+
+def parse(paragraphs, tail=None, **kwargs):
+    doc = CopyDoc(build_html(paragraphs, tail))
+    return parse_doc.parse(doc, AUTHORS, **kwargs)
+
+
+class ParseTestCase(unittest.TestCase):
+    """
+    Test the transcript parser.
+    """
+    def test_categorize(self):
+        context = parse(['DONALD TRUMP: Hello.', ':[(APPLAUSE)]',
+                         'Some other text'] + ANNOTATION)
+        types = [x['type'] for x in context['contents']]
+        self.assertEqual(types, ['speaker', 'soundbite', 'other',
+                                 'annotation'])
+        self.assertEqual(context['status'], 'during')
+
+    def test_annotation_metadata(self):
+        context = parse(ANNOTATION)
+        annotation = context['contents'][0]
+        self.assertEqual(annotation['slug'], 'first-check')
+        self.assertEqual(annotation['published'], 'yes')
+        self.assertEqual(annotation['author'], 'Domenico Montanaro')
+        self.assertIn('id="first-check"', annotation['markup'])
+
+    def test_embeds_index(self):
+        context = parse(['DONALD TRUMP: Hello.'] + ANNOTATION + ANNOTATION)
+        position, record = context['embeds']['first-check']
+        self.assertEqual(position, 1)
+        self.assertIs(record, context['contents'][1])
+        self.assertEqual(context['embeds'].keys(), ['first-check'])
+
+    def test_embeds_index_drafts(self):
+        unpublished = [line for line in ANNOTATION
+                       if not line.startswith('Published')]
+        no_slug = [line.replace('first-check', 'second-check')
+                   for line in ANNOTATION if not line.startswith('Slug')]
+        context = parse(['DONALD TRUMP: Hello.'] + unpublished + no_slug)
+        self.assertEqual(len(context['contents']), 3)
+        self.assertEqual(context['embeds'].keys(), [])
+
+    def test_end_status(self):
+        context = parse(['DONALD TRUMP: Hello.'], tail='END')
+        self.assertEqual(context['status'], 'after')
+
+
+class RecordTestCase(unittest.TestCase):
+    """
+    Test the parsed record types.
+    """
+    def test_dict_access(self):
+        context = parse(['DONALD TRUMP [00:01]: Hello.'] + ANNOTATION +
+                        ['Prior: 2'])
+        speaker, annotation, other = context['contents']
+        self.assertEqual(speaker['type'], 'speaker')
+        self.assertEqual(speaker['published'], 'yes')
+        self.assertEqual(speaker.speaker, u'DONALD TRUMP')
+        self.assertEqual(annotation['slug'], 'first-check')
+        self.assertEqual(annotation.get('prior', 1), 1)
+        self.assertRaises(KeyError, lambda: annotation['prior'])
+        self.assertEqual(other['context'], {'text': u'<p>Prior: 2</p>',
+                                            'checked': False})
+
+    def test_extra_metadata(self):
+        record = parse_doc.AnnotationRecord({'slug': 'a', 'type': 'x',
+                                             'source url': 'http://npr'},
+                                            u'<p>Text</p>')
+        self.assertEqual(record['type'], 'annotation')
+        self.assertEqual(record['source url'], 'http://npr')
+        self.assertEqual(record.context['source url'], 'http://npr')
+
+    def test_lazy_markup(self):
+        record = parse_doc.SoundbiteRecord(soundbite=u'(APPLAUSE)')
+        self.assertEqual(record.markup,
+                         u'<p class="soundbite">(APPLAUSE)</p>')
+        self.assertEqual(record.as_dict()['markup'], record.markup)
+
+    def test_markup_rendered_once(self):
+        record = parse_doc.SoundbiteRecord(soundbite=u'(APPLAUSE)')
+        markup = record.markup
+        render = parse_doc.fragment_cache.render
+        parse_doc.fragment_cache.render = None
+        try:
+            self.assertIs(record.markup, markup)
+        finally:
+            parse_doc.fragment_cache.render = render
+
+    def test_pickle(self):
+        context = parse(['DONALD TRUMP: Hello.'] + ANNOTATION)
+        for record in context['contents']:
+            copy = pickle.loads(pickle.dumps(record, 2))
+            self.assertEqual(copy, record)
+            self.assertEqual(copy.markup, record.markup)
+
+
+class ClassifyParagraphTestCase(unittest.TestCase):
+    """
+    Test the single pass paragraph classifier.
+    """
+    def test_speaker(self):
+        typ, context = parse_doc.classify_paragraph(
+            u'<p>DONALD TRUMP [00:01:02]: Hello <strong>world</strong>.</p>')
+        self.assertEqual(typ, 'speaker')
+        self.assertEqual(context, {
+            'speaker': u'DONALD TRUMP',
+            'speaker_class': 'speaker gop',
+            'timestamp': u'00:01:02',
+            'transcript_text': u'<p>Hello <strong>world</strong>.</p>'
+        })
+
+    def test_bold_speaker(self):
+        typ, context = parse_doc.classify_paragraph(
+            u'<p><strong>LESTER HOLT:</strong> Welcome.</p>')
+        self.assertEqual(typ, 'speaker')
+        self.assertEqual(context['speaker'], u'LESTER HOLT')
+        self.assertEqual(context['timestamp'], None)
+        self.assertEqual(context['transcript_text'],
+                         u'<p><strong></strong> Welcome.</p>')
+
+    def test_soundbite(self):
+        typ, context = parse_doc.classify_paragraph(u'<p>:[(APPLAUSE)]</p>')
+        self.assertEqual(typ, 'soundbite')
+        self.assertEqual(context, {'soundbite': u'(APPLAUSE)'})
+
+    def test_other(self):
+        for contents in [u'<p>Some text: more</p>',
+                         u'<p>SPEAKER 2: numbers are not names</p>',
+                         u'<p>:not a soundbite</p>']:
+            typ, context = parse_doc.classify_paragraph(contents)
+            self.assertEqual(typ, 'other')
+            self.assertEqual(context, {'text': contents, 'checked': False})
+
+    def test_checked(self):
+        typ, context = parse_doc.classify_paragraph(
+            u'<p><strong>Checked</strong> claim</p>')
+        self.assertTrue(context['checked'])
+
+    def test_long_whitespace(self):
+        start = time.time()
+        typ, context = parse_doc.classify_paragraph(
+            u'<p>A' + u' ' * 20000 + u'</p>')
+        self.assertEqual(typ, 'other')
+        typ, context = parse_doc.classify_paragraph(
+            u'<p>DONALD TRUMP' + u' ' * 20000 + u': Hello.</p>')
+        self.assertEqual(context['speaker'], u'DONALD TRUMP')
+        self.assertLess(time.time() - start, 1)
+
+
+class IncrementalParseTestCase(unittest.TestCase):
+    """
+    Test reusing records between incremental parses.
+    """
+    def setUp(self):
+        self.cache = parse_doc.IncrementalCache()
+
+    def test_matches_full_parse(self):
+        paragraphs = ['DONALD TRUMP: Hello.', 'Other'] + ANNOTATION
+        full = parse(paragraphs)
+        incremental = parse(paragraphs, incremental=self.cache)
+        self.assertEqual(full, incremental)
+
+    def test_reuses_unchanged_records(self):
+        first = parse(['DONALD TRUMP: Hello.'] + ANNOTATION,
+                      incremental=self.cache)
+        second = parse(['DONALD TRUMP: Hello.'] + ANNOTATION +
+                       ['HILLARY CLINTON: Bye.'], incremental=self.cache)
+        self.assertIs(first['contents'][0], second['contents'][0])
+        self.assertIs(first['contents'][1], second['contents'][1])
+        self.assertEqual(second['contents'][2]['type'], 'speaker')
+
+    def test_reprocesses_edited_records(self):
+        first = parse(['DONALD TRUMP: Hello.'], incremental=self.cache)
+        second = parse(['DONALD TRUMP: Hello again.'], incremental=self.cache)
+        self.assertIsNot(first['contents'][0], second['contents'][0])
+        self.assertIn('Hello again.', second['contents'][0]['markup'])
+
+    def test_documents_do_not_share_records(self):
+        other = parse_doc.IncrementalCache()
+        first = parse(['DONALD TRUMP: Hello.'], incremental=self.cache)
+        parse(['HILLARY CLINTON: Bye.'], incremental=other)
+        second = parse(['DONALD TRUMP: Hello.'], incremental=self.cache)
+        self.assertIs(first['contents'][0], second['contents'][0])
+
+
+class ParallelParseTestCase(unittest.TestCase):
+    """
+    Test that processing records on a pool matches the serial parse.
+    """
+    def setUp(self):
+        self.cache = parse_doc.IncrementalCache()
+        html = build_html(['DONALD TRUMP [00:01]: Hello &amp; bye.',
+                           ':[(APPLAUSE)]', 'Some <b>other</b> text'] +
+                          ANNOTATION + ['HILLARY CLINTON: Response.'] +
+                          ANNOTATION)
+        self.raw_contents, status = parse_doc.categorize_doc_content(
+            CopyDoc(html))
+
+    def test_matches_serial(self):
+        serial = parse_doc.parse_raw_contents(self.raw_contents, None,
+                                              AUTHORS, parallel=False)
+        parallel = parse_doc.parse_raw_contents(self.raw_contents, None,
+                                                AUTHORS, parallel=True)
+        self.assertEqual(serial, parallel)
+
+    def test_incremental(self):
+        serial = parse_doc.parse_raw_contents(self.raw_contents, None,
+                                              AUTHORS, parallel=False)
+        parse_doc.parse_raw_contents(self.raw_contents[:2], None, AUTHORS,
+                                     incremental=self.cache)
+        parallel = parse_doc.parse_raw_contents(self.raw_contents, None,
+                                                AUTHORS,
+                                                incremental=self.cache,
+                                                parallel=True)
+        self.assertEqual(serial, parallel)
+
+
+class StreamingCategorizerTestCase(unittest.TestCase):
+    """
+    Test the streaming categorizer against the tree based one.
+    """
+    def assertSameParse(self, paragraphs, tail=None):
+        html = build_html(paragraphs, tail)
+        expected = parse_doc.parse(CopyDoc(html), AUTHORS)
+        streamed = parse_doc.parse(parse_doc.StreamingCategorizer(html),
+                                   AUTHORS)
+        self.assertEqual(expected, streamed)
+        return streamed
+
+    def test_records(self):
+        self.assertSameParse(['DONALD TRUMP: <b>Hello</b> &amp; bye.',
+                              ':[(APPLAUSE)]',
+                              'Some other text'] + ANNOTATION)
+
+    def test_empty(self):
+        context = self.assertSameParse([])
+        self.assertEqual(context['status'], 'before')
+
+    def test_end_markers(self):
+        context = self.assertSameParse(['DONALD TRUMP: Hi.'], tail='END')
+        self.assertEqual(context['status'], 'after')
+        context = self.assertSameParse(['DONALD TRUMP: Hi.'],
+                                       tail='LIVE TRANSCRIPT HAS ENDED')
+        self.assertEqual(context['status'], 'transcript-end')
+
+    def test_do_not_write_marker(self):
+        context = self.assertSameParse(['DONALD TRUMP: Hi.'],
+                                       tail='DO NOT WRITE BELOW THIS LINE')
+        self.assertEqual(context['status'], 'during')
+        context = self.assertSameParse(
+            ['DONALD TRUMP: Hi.'],
+            tail='DO NOT WRITE BELOW THIS LINE ERROR')
+        self.assertEqual(context['status'], 'error')
+
+    def test_small_reads(self):
+        html = build_html(['DONALD TRUMP: Hello.'] + ANNOTATION)
+        categorizer = parse_doc.StreamingCategorizer(StringIO(html),
+                                                     chunk_size=7)
+        types = [r['type'] for r in categorizer]
+        self.assertEqual(types, ['transcript', 'annotation'])
+
+
+class AuthorsCacheTestCase(unittest.TestCase):
+    """
+    Test reloading the authors dictionary only when the file changes.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.authors_path = app_config.AUTHORS_PATH
+        app_config.AUTHORS_PATH = os.path.join(self.tmpdir, 'authors.xlsx')
+        parse_doc._authors_cache['stat'] = None
+
+    def tearDown(self):
+        app_config.AUTHORS_PATH = self.authors_path
+        parse_doc._authors_cache['stat'] = None
+        shutil.rmtree(self.tmpdir)
+
+    def write_authors(self, rows, mtime):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['initials', 'name', 'role', 'page', 'img'])
+        for row in rows:
+            sheet.append(row)
+        workbook.save(app_config.AUTHORS_PATH)
+        os.utime(app_config.AUTHORS_PATH, (mtime, mtime))
+
+    def test_reload_on_change(self):
+        self.write_authors([['dm', 'Domenico Montanaro', 'Editor',
+                             'page', 'img']], 1000)
+        authors = parse_doc.get_authors()
+        self.assertEqual(authors['dm']['name'], 'Domenico Montanaro')
+        self.assertIs(parse_doc.get_authors(), authors)
+
+        self.write_authors([['dm', 'D. Montanaro', 'Editor',
+                             'page', 'img']], 2000)
+        authors = parse_doc.get_authors()
+        self.assertEqual(authors['dm']['name'], 'D. Montanaro')
+
+if __name__ == '__main__':
+    unittest.main()
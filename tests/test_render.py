@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import unittest
+
+from fabfile import render
+from test_parse_doc import ANNOTATION, parse
+
+
+class EmbedDigestsTestCase(unittest.TestCase):
+    """
+    Test tracking the inputs of each embed.
+    """
+    def test_append_paragraph(self):
+        before = render.embed_digests(parse(
+            ['DONALD TRUMP: Hello.'] + ANNOTATION))
+        after = render.embed_digests(parse(
+            ['DONALD TRUMP: Hello.'] + ANNOTATION +
+            ['HILLARY CLINTON: Goodbye.']))
+        self.assertEqual(before, after)
+
+    def test_change_prior(self):
+        before = render.embed_digests(parse(
+            ['DONALD TRUMP: Hello.'] + ANNOTATION))
+        after = render.embed_digests(parse(
+            ['DONALD TRUMP: Hello again.'] + ANNOTATION))
+        self.assertNotEqual(before['first-check'], after['first-check'])
+        self.assertEqual(before[None], after[None])
+
+    def test_unpublished(self):
+        unpublished = [p.replace('Published: Yes', 'Published: No')
+                       for p in ANNOTATION]
+        digests = render.embed_digests(parse(
+            ['DONALD TRUMP: Hello.'] + unpublished))
+        self.assertEqual(digests.keys(), [None])
+
+if __name__ == '__main__':
+    unittest.main()